@@ -0,0 +1,224 @@
+"""Offline analytics over a snapshot of the service databases.
+
+Each live database is copied in a single step of SQLite's online backup API,
+which gives a consistent point-in-time copy of that file. (A stepped backup
+restarts from the first page whenever another connection writes, so under
+steady traffic it may never finish.) The copy holds a read lock on the
+source, so writers wait until it completes; on a large database run it off
+peak.
+
+``orders.db`` is copied first and ``inventory.db`` straight after, so stock
+on hand can be up to the inventory copy time newer than the orders; the
+skew is printed. Reports then run against the snapshot, opened read-only,
+as SQL aggregates whose results are streamed with ``fetchmany``, so memory
+stays bounded by the result size (locations, SKUs) rather than the table
+size.
+
+Run from the service root:
+
+    python -m scripts.analytics snapshot --out snapshots/2024-06-01
+    python -m scripts.analytics report --snapshot snapshots/2024-06-01 --top 20 --days 30
+    python -m scripts.analytics export --snapshot snapshots/2024-06-01 --out exports/
+
+``export`` writes Parquet files in row groups of ``--chunk-size`` rows and
+needs ``pyarrow`` (optional; not part of the service image).
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+SERVICE_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_INVENTORY_DB = SERVICE_ROOT / "inventory.db"
+DEFAULT_ORDERS_DB = SERVICE_ROOT.parent / "order-service" / "orders.db"
+FETCH_SIZE = 10_000
+
+
+def snapshot(source: Path, destination: Path):
+    """Copy ``source`` to ``destination`` in one backup step."""
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(destination)
+    try:
+        src.backup(dst, pages=-1)
+    finally:
+        dst.close()
+        src.close()
+
+
+def open_snapshot(snapshot_dir: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(f"file:{snapshot_dir / 'inventory.db'}?mode=ro", uri=True)
+    orders = snapshot_dir / "orders.db"
+    if orders.exists():
+        conn.execute("ATTACH DATABASE ? AS orders", (f"file:{orders}?mode=ro",))
+    return conn
+
+
+def has_orders(conn: sqlite3.Connection) -> bool:
+    return any(row[1] == "orders" for row in conn.execute("PRAGMA database_list"))
+
+
+def stream(conn: sqlite3.Connection, sql: str, params=()):
+    cursor = conn.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+
+def stock_by_location(conn: sqlite3.Connection):
+    return stream(
+        conn,
+        "SELECT l.location, t.skus, t.quantity FROM "
+        "(SELECT location_id, COUNT(*) AS skus, SUM(quantity) AS quantity FROM inventory GROUP BY location_id) t "
+        "JOIN locations l ON l.id = t.location_id ORDER BY t.quantity DESC",
+    )
+
+
+def top_skus(conn: sqlite3.Connection, limit: int):
+    # GROUP BY sku_id walks the (sku_id, location_id) primary key in order, and
+    # ORDER BY ... LIMIT only keeps ``limit`` rows in the sorter.
+    return stream(
+        conn,
+        "SELECT s.sku, t.quantity FROM "
+        "(SELECT sku_id, SUM(quantity) AS quantity FROM inventory GROUP BY sku_id "
+        "ORDER BY quantity DESC LIMIT ?) t JOIN skus s ON s.id = t.sku_id ORDER BY t.quantity DESC",
+        (limit,),
+    )
+
+
+def turnover(conn: sqlite3.Connection, limit: int, days: int):
+    """Units sold per SKU over ``days`` (non-cancelled orders) relative to stock on hand."""
+    since = time.time() - days * 24 * 60 * 60
+    return stream(
+        conn,
+        "SELECT sold.sku, sold.units, COALESCE(SUM(i.quantity), 0) AS on_hand, "
+        "sold.units * 1.0 / NULLIF(SUM(i.quantity), 0) AS turnover FROM "
+        "(SELECT oi.sku, SUM(oi.quantity) AS units FROM orders.order_items oi "
+        " JOIN orders.orders o ON o.id = oi.order_id "
+        " WHERE o.status NOT IN ('cancelling', 'cancelled') AND o.created_at >= ? GROUP BY oi.sku) sold "
+        "LEFT JOIN skus s ON s.sku = sold.sku "
+        "LEFT JOIN inventory i ON i.sku_id = s.id "
+        "GROUP BY sold.sku ORDER BY turnover IS NULL, turnover DESC LIMIT ?",
+        (since, limit),
+    )
+
+
+def print_rows(title, headers, rows):
+    print(f"\n{title}")
+    print(" | ".join(f"{h:>14}" if i else f"{h:24}" for i, h in enumerate(headers)))
+    print("-" * (27 + 17 * (len(headers) - 1)))
+    empty = True
+    for row in rows:
+        empty = False
+        cells = []
+        for i, value in enumerate(row):
+            if i == 0:
+                cells.append(f"{value:24}")
+            elif isinstance(value, float):
+                cells.append(f"{value:14.2f}")
+            else:
+                cells.append(f"{'-' if value is None else value:>14}")
+        print(" | ".join(cells))
+    if empty:
+        print("(no rows)")
+
+
+def export_parquet(conn: sqlite3.Connection, out_dir: Path, chunk_size: int):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        sys.exit("export needs pyarrow: pip install pyarrow")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tables = {
+        "inventory": (
+            pa.schema([("sku", pa.string()), ("location", pa.string()), ("quantity", pa.int64())]),
+            "SELECT s.sku, l.location, i.quantity FROM inventory i "
+            "JOIN skus s ON s.id = i.sku_id JOIN locations l ON l.id = i.location_id",
+        ),
+    }
+    if has_orders(conn):
+        tables["order_items"] = (
+            pa.schema([
+                ("order_id", pa.int64()), ("status", pa.string()), ("created_at", pa.float64()),
+                ("sku", pa.string()), ("quantity", pa.int64()),
+            ]),
+            "SELECT o.id, o.status, o.created_at, oi.sku, oi.quantity FROM orders.order_items oi "
+            "JOIN orders.orders o ON o.id = oi.order_id",
+        )
+    for name, (schema, sql) in tables.items():
+        path = out_dir / f"{name}.parquet"
+        cursor = conn.execute(sql)
+        rows_written = 0
+        with pq.ParquetWriter(path, schema) as writer:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                columns = list(zip(*rows))
+                writer.write_batch(pa.record_batch([pa.array(c) for c in columns], schema=schema))
+                rows_written += len(rows)
+        print(f"Wrote {rows_written} rows to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline analytics over a read-only snapshot.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    snap = commands.add_parser("snapshot", help="Take a consistent online snapshot of the databases")
+    snap.add_argument("--inventory-db", type=Path, default=DEFAULT_INVENTORY_DB)
+    snap.add_argument("--orders-db", type=Path, default=DEFAULT_ORDERS_DB)
+    snap.add_argument("--out", type=Path, required=True, help="Snapshot directory")
+
+    report = commands.add_parser("report", help="Stock by location, top SKUs and turnover")
+    report.add_argument("--snapshot", type=Path, required=True)
+    report.add_argument("--top", type=int, default=20)
+    report.add_argument("--days", type=int, default=30, help="Turnover window")
+
+    export = commands.add_parser("export", help="Materialize the snapshot as Parquet")
+    export.add_argument("--snapshot", type=Path, required=True)
+    export.add_argument("--out", type=Path, required=True)
+    export.add_argument("--chunk-size", type=int, default=100_000)
+
+    args = parser.parse_args()
+    if args.command == "snapshot":
+        args.out.mkdir(parents=True, exist_ok=True)
+        taken_at = {}
+        for name, source in (("orders.db", args.orders_db), ("inventory.db", args.inventory_db)):
+            if not source.exists():
+                print(f"Skipping {source}: not found")
+                continue
+            start = time.perf_counter()
+            snapshot(source, args.out / name)
+            taken_at[name] = time.perf_counter()
+            size_mb = os.path.getsize(args.out / name) / 1e6
+            print(f"Snapshot {source} -> {args.out / name} ({size_mb:.1f} MB, {taken_at[name] - start:.1f}s)")
+        if len(taken_at) == 2:
+            skew = taken_at["inventory.db"] - taken_at["orders.db"]
+            print(f"inventory.db is up to {skew:.1f}s newer than orders.db")
+        return
+
+    conn = open_snapshot(args.snapshot)
+    try:
+        if args.command == "report":
+            print_rows("Stock by location", ("Location", "SKUs", "Quantity"), stock_by_location(conn))
+            print_rows(f"Top {args.top} SKUs by stock", ("SKU", "Quantity"), top_skus(conn, args.top))
+            if has_orders(conn):
+                print_rows(
+                    f"Top {args.top} SKUs by turnover ({args.days} days)",
+                    ("SKU", "Units sold", "On hand", "Turnover"),
+                    turnover(conn, args.top, args.days),
+                )
+            else:
+                print("\nNo orders.db in snapshot; skipping turnover.")
+        elif args.command == "export":
+            export_parquet(conn, args.out, args.chunk_size)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Microbenchmark: per-request cost of the get_api_key dependency.
+
+Compares the old single-key string comparison against the registry lookup
+(hash + dict lookup), with and without the token
+bucket charged by the admission layer, for a registry holding ``--keys``
+client keys.
+
+Run from the service root:
+
+    python -m scripts.bench_auth --keys 10000
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from starlette.requests import Request
+
+from src import auth
+from src.schema import create_schema
+
+
+def per_call_us(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--keys", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        database = os.path.join(workdir, "inventory.db")
+        conn = sqlite3.connect(database)
+        create_schema(conn)
+        for i in range(args.keys):
+            auth.register_key(conn, f"key-{i}", f"client-{i}", {"read"})
+        auth.register_key(conn, "limited", "limited", {"read"}, rate_per_second=1e9, burst=10**9)
+        conn.close()
+
+        registry = auth.KeyRegistry("bootstrap-key")
+        registry.load(database)
+        auth.API_KEYS = registry
+        request = Request({"type": "http", "method": "GET", "headers": []})
+
+        single_key = "bootstrap-key"
+        cases = [
+            ("single key ==", lambda: "key-42" == single_key),
+            ("registry, no bucket", lambda: auth.get_api_key(request, "key-42")),
+            ("registry, token bucket", lambda: (
+                registry.authenticate("limited").bucket.try_acquire(), auth.get_api_key(request, "limited"))),
+        ]
+        print(f"{len(registry)} keys loaded")
+        for name, fn in cases:
+            print(f"{name:24} | {per_call_us(fn, args.repeat):6.2f} us/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Compare DB size and query latency of the legacy text-keyed inventory table
+against the interned (integer ID) layout.
+
+Run from the service root:
+
+    python -m scripts.bench_interning --skus 20000 --locations 10
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from src.schema import create_schema
+
+LEGACY_QUERIES = {
+    "filter by location": (
+        "SELECT sku, location, quantity FROM inventory WHERE location=? LIMIT 1000",
+        lambda db: ("store3",),
+    ),
+    "filter by sku": (
+        "SELECT location, quantity FROM inventory WHERE sku=?",
+        lambda db: ("SKU0012345",),
+    ),
+    "page with offset": (
+        "SELECT sku, location, quantity FROM inventory LIMIT 1000 OFFSET 50000",
+        lambda db: (),
+    ),
+}
+
+INTERNED_QUERIES = {
+    "filter by location": (
+        "SELECT s.sku, l.location, p.quantity FROM "
+        "(SELECT sku_id, location_id, quantity FROM inventory WHERE location_id=? LIMIT 1000) p "
+        "JOIN skus s ON s.id = p.sku_id JOIN locations l ON l.id = p.location_id",
+        lambda db: db.execute("SELECT id FROM locations WHERE location='store3'").fetchone(),
+    ),
+    "filter by sku": (
+        "SELECT l.location, i.quantity FROM inventory i "
+        "JOIN locations l ON l.id = i.location_id WHERE i.sku_id=?",
+        lambda db: db.execute("SELECT id FROM skus WHERE sku='SKU0012345'").fetchone(),
+    ),
+    "page with offset": (
+        "SELECT s.sku, l.location, p.quantity FROM "
+        "(SELECT sku_id, location_id, quantity FROM inventory LIMIT 1000 OFFSET 50000) p "
+        "JOIN skus s ON s.id = p.sku_id JOIN locations l ON l.id = p.location_id",
+        lambda db: (),
+    ),
+}
+
+
+def build_legacy(path, skus, locations):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE inventory (sku TEXT, location TEXT, quantity INTEGER, PRIMARY KEY(sku, location))"
+    )
+    location_names = [f"store{i}" for i in range(locations)]
+    conn.executemany(
+        "INSERT INTO inventory VALUES (?, ?, ?)",
+        ((f"SKU{s:07d}", loc, s % 500) for s in range(skus) for loc in location_names),
+    )
+    conn.commit()
+    conn.close()
+
+
+def time_queries(path, queries, repeat):
+    conn = sqlite3.connect(path)
+    results = {}
+    for name, (sql, params) in queries.items():
+        args = params(conn)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            conn.execute(sql, args).fetchall()
+        results[name] = (time.perf_counter() - start) / repeat * 1000
+    conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--skus", type=int, default=20000)
+    parser.add_argument("--locations", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        legacy = os.path.join(workdir, "legacy.db")
+        interned = os.path.join(workdir, "interned.db")
+        build_legacy(legacy, args.skus, args.locations)
+        shutil.copy(legacy, interned)
+
+        start = time.perf_counter()
+        conn = sqlite3.connect(interned)
+        create_schema(conn)
+        conn.execute("VACUUM")
+        conn.close()
+        migrate_ms = (time.perf_counter() - start) * 1000
+
+        legacy_size = os.path.getsize(legacy)
+        interned_size = os.path.getsize(interned)
+        print(f"rows: {args.skus * args.locations}  (migration took {migrate_ms:.0f} ms)")
+        print(f"{'db file size':20} | {legacy_size / 1e6:9.2f} MB | {interned_size / 1e6:9.2f} MB"
+              f" | {interned_size / legacy_size:6.2f}x")
+
+        legacy_times = time_queries(legacy, LEGACY_QUERIES, args.repeat)
+        interned_times = time_queries(interned, INTERNED_QUERIES, args.repeat)
+        for name in LEGACY_QUERIES:
+            print(f"{name:20} | {legacy_times[name]:9.3f} ms | {interned_times[name]:9.3f} ms"
+                  f" | {interned_times[name] / legacy_times[name]:6.2f}x")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Microbenchmark: CPU per response for the Pydantic-model path versus the
+lean row-to-JSON path used by list_inventory and batch_adjust_inventory.
+
+The model path mirrors what FastAPI does with a ``response_model``: build one
+model per row, validate the list against the response type, dump it to JSON
+compatible data and encode it with the stdlib encoder.
+
+Run from the service root:
+
+    python -m scripts.bench_serialization --rows 1000 --batch 10000
+"""
+import argparse
+import json
+import os
+import time
+from typing import List
+
+os.environ.setdefault("INVENTORY_API_KEY", "bench")
+
+from pydantic import TypeAdapter  # noqa: E402
+
+from src.main import INVENTORY_FIELDS, BatchAdjustmentResult, InventoryItem, Stock, batch_result  # noqa: E402
+from src.serialization import encode_rows, dumps  # noqa: E402
+
+
+def cpu_ms(fn, repeat):
+    fn()
+    start = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return (time.process_time() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rows = [(f"SKU{i:07d}", f"store{i % 10}", i % 500) for i in range(args.rows)]
+    item_adapter = TypeAdapter(List[InventoryItem])
+
+    def list_models():
+        items = [InventoryItem(sku=r[0], location=r[1], quantity=r[2]) for r in rows]
+        validated = item_adapter.validate_python(items, from_attributes=True)
+        json.dumps(item_adapter.dump_python(validated, mode="json")).encode("utf-8")
+
+    def list_lean():
+        encode_rows(rows, INVENTORY_FIELDS)
+
+    stocks = [Stock(sku=f"SKU{i:07d}", location=f"store{i % 10}", quantity=1) for i in range(args.batch)]
+    result_adapter = TypeAdapter(List[BatchAdjustmentResult])
+
+    def batch_models():
+        results = [
+            BatchAdjustmentResult(sku=s.sku, location=s.location, quantity=i, success=True)
+            for i, s in enumerate(stocks)
+        ]
+        validated = result_adapter.validate_python(results, from_attributes=True)
+        json.dumps(result_adapter.dump_python(validated, mode="json")).encode("utf-8")
+
+    def batch_lean():
+        dumps([batch_result(s, quantity=i) for i, s in enumerate(stocks)])
+
+    cases = [
+        (f"list_inventory ({args.rows} rows)", list_models, list_lean),
+        (f"batch_adjust ({args.batch} items)", batch_models, batch_lean),
+    ]
+    print(f"{'response':32} | {'models':>10} | {'lean':>10} | speedup")
+    for name, slow, fast in cases:
+        slow_ms = cpu_ms(slow, args.repeat)
+        fast_ms = cpu_ms(fast, args.repeat)
+        print(f"{name:32} | {slow_ms:7.2f} ms | {fast_ms:7.2f} ms | {slow_ms / fast_ms:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Report memory footprint, false-positive rate and lookup cost of the
+unknown-SKU Bloom filter, against the database probe it replaces.
+
+Run from the service root:
+
+    python -m scripts.bench_sku_filter --skus 1000000 --probes 100000
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from src.skufilter import FP_RATE, GROWTH_FACTOR, BloomFilter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--skus", type=int, default=1_000_000)
+    parser.add_argument("--probes", type=int, default=100_000)
+    parser.add_argument("--fp-rate", type=float, default=FP_RATE)
+    args = parser.parse_args()
+
+    known = [f"SKU{i:09d}" for i in range(args.skus)]
+    unknown = [f"GONE{i:09d}" for i in range(args.probes)]
+
+    start = time.perf_counter()
+    bloom = BloomFilter(args.skus * GROWTH_FACTOR, args.fp_rate)
+    for sku in known:
+        bloom.add(sku)
+    build_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    false_positives = sum(sku in bloom for sku in unknown)
+    filter_us = (time.perf_counter() - start) / args.probes * 1e6
+
+    print(f"SKUs: {args.skus}  capacity: {bloom.capacity}  hashes: {bloom.hash_count}  build: {build_s:.1f}s")
+    print(f"memory:              {len(bloom.bits) / 1e6:.2f} MB ({len(bloom.bits) * 8 / args.skus:.1f} bits/SKU)")
+    print(f"target fp rate:      {args.fp_rate:.4f} at full capacity")
+    print(f"estimated fp rate:   {bloom.estimated_fp_rate(args.skus):.4f} at {args.skus} SKUs")
+    print(f"observed fp rate:    {false_positives / args.probes:.4f} ({false_positives}/{args.probes})")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        database = os.path.join(workdir, "inventory.db")
+        conn = sqlite3.connect(database)
+        conn.execute("CREATE TABLE skus (id INTEGER PRIMARY KEY, sku TEXT NOT NULL UNIQUE)")
+        conn.executemany("INSERT INTO skus (sku) VALUES (?)", ((sku,) for sku in known))
+        conn.commit()
+        conn.close()
+        sample = unknown[: min(len(unknown), 20_000)]
+        start = time.perf_counter()
+        for sku in sample:
+            # What a 404 cost before: open a connection, probe, close.
+            conn = sqlite3.connect(database)
+            conn.execute("SELECT id FROM skus WHERE sku=?", (sku,)).fetchone()
+            conn.close()
+        db_us = (time.perf_counter() - start) / len(sample) * 1e6
+
+    print(f"filter check:        {filter_us:.2f} us/lookup")
+    print(f"db probe (connect):  {db_us:.2f} us/lookup")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Manage inventory-service API keys.
+
+Run from the service root:
+
+    python -m scripts.manage_keys add storefront --scopes read --rate 50 --burst 100
+    python -m scripts.manage_keys list
+    python -m scripts.manage_keys revoke storefront
+
+Running services pick up changes within API_KEY_RELOAD_INTERVAL_SECONDS.
+"""
+import argparse
+import secrets
+import sqlite3
+
+from src.auth import ALL_SCOPES, register_key, revoke_client
+from src.schema import create_schema
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage inventory-service API keys.")
+    parser.add_argument("--db", default="inventory.db", help="Path to inventory.db")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="Create a key for a client and print it once")
+    add.add_argument("client_id")
+    add.add_argument("--scopes", default=",".join(sorted(ALL_SCOPES)), help="Comma-separated: read,write")
+    add.add_argument("--rate", type=float, default=None, help="Requests per second (default: unlimited)")
+    add.add_argument("--burst", type=int, default=None, help="Bucket size (default: ceil(rate))")
+
+    commands.add_parser("list", help="List clients and their scopes")
+
+    revoke = commands.add_parser("revoke", help="Deactivate all keys of a client")
+    revoke.add_argument("client_id")
+
+    args = parser.parse_args()
+    conn = sqlite3.connect(args.db)
+    try:
+        create_schema(conn)
+        if args.command == "add":
+            api_key = secrets.token_urlsafe(32)
+            scopes = {s.strip() for s in args.scopes.split(",") if s.strip()}
+            register_key(conn, api_key, args.client_id, scopes, args.rate, args.burst)
+            print(f"API key for {args.client_id}: {api_key}")
+            print("Store it now; only its hash is kept.")
+        elif args.command == "list":
+            rows = conn.execute(
+                "SELECT client_id, scopes, rate_per_second, burst, active FROM api_keys ORDER BY client_id"
+            ).fetchall()
+            print("{:20} | {:12} | {:8} | {:6} | {}".format("Client", "Scopes", "Rate/s", "Burst", "Active"))
+            for client_id, scopes, rate, burst, active in rows:
+                print("{:20} | {:12} | {:8} | {:6} | {}".format(
+                    client_id, scopes, rate or "-", burst or "-", "yes" if active else "no"))
+        elif args.command == "revoke":
+            print(f"Revoked {revoke_client(conn, args.client_id)} key(s) for {args.client_id}.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
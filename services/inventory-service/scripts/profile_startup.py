@@ -0,0 +1,122 @@
+"""Measure inventory-service cold start and enforce a budget.
+
+Each run starts a fresh interpreter in a scratch directory and records:
+
+- import:        ``import src.main``
+- init_db:       schema check/migration and cache loads (startup handler)
+- first request: one ``GET /inventory`` through the ASGI app
+
+Runs alternate between a fresh database and one that is already at the
+current schema version. The median of each phase is reported, and the process
+exits non-zero when the median total exceeds ``--budget-ms``.
+
+Run from the service root:
+
+    python -m scripts.profile_startup --runs 5 --budget-ms 1500
+    python -m scripts.profile_startup --imports 15   # slowest imports
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+SERVICE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import asyncio, json, os, time
+# Probe with whatever bootstrap key is configured, e.g. the one CI exports for pytest.
+API_KEY = os.environ.setdefault("INVENTORY_API_KEY", "profile-key")
+t0 = time.perf_counter()
+import src.main as main
+t1 = time.perf_counter()
+main.init_db()
+t2 = time.perf_counter()
+
+async def first_request():
+    sent = []
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/inventory", "raw_path": b"/inventory", "query_string": b"",
+        "root_path": "", "headers": [(b"x-api-key", API_KEY.encode())],
+        "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80),
+    }
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+    async def send(message):
+        sent.append(message)
+    await main.app(scope, receive, send)
+    return sent[0]["status"]
+
+status = asyncio.run(first_request())
+t3 = time.perf_counter()
+print(json.dumps({"status": status, "import": t1 - t0, "init_db": t2 - t1, "first_request": t3 - t2}))
+"""
+
+
+def run_once(workdir):
+    env = dict(os.environ, PYTHONPATH=SERVICE_ROOT)
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=workdir, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def print_slowest_imports(count):
+    env = dict(os.environ, PYTHONPATH=SERVICE_ROOT)
+    env.setdefault("INVENTORY_API_KEY", "profile-key")
+    with tempfile.TemporaryDirectory() as workdir:
+        stderr = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import src.main"],
+            cwd=workdir, env=env, capture_output=True, text=True, check=True,
+        ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), name.strip()))
+    print(f"{'module':40} | cumulative")
+    for cumulative, name in sorted(rows, reverse=True)[:count]:
+        print(f"{name:40} | {cumulative / 1000:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure inventory-service cold start.")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per database state")
+    parser.add_argument("--budget-ms", type=float, default=None, help="Fail if the median total exceeds this")
+    parser.add_argument("--imports", type=int, default=0, help="Also list the N slowest imports")
+    args = parser.parse_args()
+
+    samples = {"fresh db": [], "existing db": []}
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, "inventory.db")
+        for _ in range(args.runs):
+            if os.path.exists(db_path):
+                os.remove(db_path)
+            samples["fresh db"].append(run_once(workdir))
+            samples["existing db"].append(run_once(workdir))
+
+    worst_total = 0.0
+    print(f"{'state':12} | {'import':>9} | {'init_db':>9} | {'1st req':>9} | {'total':>9}")
+    for state, runs in samples.items():
+        if any(r["status"] != 200 for r in runs):
+            sys.exit(f"first request failed during {state} runs: {[r['status'] for r in runs]}")
+        phases = {p: statistics.median(r[p] for r in runs) * 1000 for p in ("import", "init_db", "first_request")}
+        total = statistics.median((r["import"] + r["init_db"] + r["first_request"]) * 1000 for r in runs)
+        worst_total = max(worst_total, total)
+        print(f"{state:12} | {phases['import']:6.1f} ms | {phases['init_db']:6.1f} ms"
+              f" | {phases['first_request']:6.1f} ms | {total:6.1f} ms")
+
+    if args.imports:
+        print()
+        print_slowest_imports(args.imports)
+
+    if args.budget_ms is not None and worst_total > args.budget_ms:
+        sys.exit(f"cold start {worst_total:.1f} ms exceeds budget of {args.budget_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,10 @@ from pathlib import Path
 # Get the absolute path to the directory containing this script.
 script_directory = Path(__file__).parent.absolute()
 DATABASE = script_directory.parent / "inventory.db"
+PREVIEW_ROWS = 50
 
 def print_table(df):
-    print("\nInventory Table:")
+    print(f"\nInventory Table (first {PREVIEW_ROWS} rows):")
     print(df.to_string(index=False))
 
 def print_ascii_bar_chart(series):
@@ -20,17 +21,35 @@ def print_ascii_bar_chart(series):
         print(f"{loc.ljust(max_label)} | {bar} ({qty})")
 
 def visualize_inventory():
-    """Fetches data from the database and prints inventory as a table and ASCII bar chart."""
+    """Prints a preview of the inventory table and an ASCII bar chart of stock by location.
+
+    Only the preview rows and the per-location totals are loaded; for full
+    reports on large databases use ``python -m scripts.analytics``.
+    """
     try:
         # Check if the database file exists
         if not Path(DATABASE).exists():
             print(f"Error: Database file not found at {DATABASE}")
             return
 
-        conn = sqlite3.connect(DATABASE)
+        conn = sqlite3.connect(f"file:{DATABASE}?mode=ro", uri=True)
+
+        # Read a preview of the 'inventory' table into a pandas DataFrame
+        df = pd.read_sql_query(
+            "SELECT s.sku, l.location, p.quantity FROM "
+            "(SELECT sku_id, location_id, quantity FROM inventory LIMIT ?) p "
+            "JOIN skus s ON s.id = p.sku_id JOIN locations l ON l.id = p.location_id",
+            conn,
+            params=(PREVIEW_ROWS,),
+        )
 
-        # Read the entire 'inventory' table into a pandas DataFrame
-        df = pd.read_sql_query("SELECT * FROM inventory", conn)
+        # Let SQLite sum the quantities per location instead of loading every row
+        inventory_by_location = pd.read_sql_query(
+            "SELECT l.location, t.quantity FROM "
+            "(SELECT location_id, SUM(quantity) AS quantity FROM inventory GROUP BY location_id) t "
+            "JOIN locations l ON l.id = t.location_id ORDER BY l.location",
+            conn,
+        ).set_index("location")["quantity"]
 
         # Close the database connection
         conn.close()
@@ -42,9 +61,6 @@ def visualize_inventory():
 
         print_table(df)
 
-        # Group the data by location and sum the quantities
-        inventory_by_location = df.groupby("location")["quantity"].sum()
-
         print_ascii_bar_chart(inventory_by_location)
 
     except sqlite3.Error as e:
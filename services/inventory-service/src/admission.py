@@ -0,0 +1,198 @@
+"""Admission control: per-key rate limits, per-route-class concurrency and load shedding.
+
+Every request passes through ``admission_control`` before it reaches the
+threadpool:
+
+1. The API key is authenticated once and stored on ``request.state`` for
+   ``get_api_key``. A missing or unknown key gets ``401`` without taking a
+   slot or a queue position. The caller's token bucket is charged; an empty
+   bucket is answered with ``429`` straight from the event loop.
+2. Batch endpoints whose ``Content-Length`` exceeds
+   ``ADMISSION_MAX_BATCH_BYTES`` get ``413`` before their body is read.
+3. The request takes a slot from the ``reads`` (GET/HEAD/OPTIONS) or
+   ``writes`` limiter. When all slots are busy it queues; if the queue is full
+   or no slot frees up within ``ADMISSION_MAX_QUEUE_WAIT_MS`` it is shed with
+   ``503`` instead of piling up latency behind a single SQLite file.
+
+All limiter state is only touched from the event loop, so no locks are needed.
+"""
+import asyncio
+import collections
+import math
+import os
+from typing import Deque, Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from .auth import API_KEY_NAME, API_KEYS, READ_METHODS
+
+READ_CONCURRENCY = int(os.environ.get("ADMISSION_READ_CONCURRENCY", 32))
+WRITE_CONCURRENCY = int(os.environ.get("ADMISSION_WRITE_CONCURRENCY", 4))
+MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", 64))
+MAX_QUEUE_WAIT_SECONDS = int(os.environ.get("ADMISSION_MAX_QUEUE_WAIT_MS", 500)) / 1000
+MAX_BATCH_SIZE = int(os.environ.get("ADMISSION_MAX_BATCH_SIZE", 10_000))
+# About 256 bytes of JSON per adjustment; the endpoint still enforces MAX_BATCH_SIZE.
+MAX_BATCH_BYTES = int(os.environ.get("ADMISSION_MAX_BATCH_BYTES", MAX_BATCH_SIZE * 256))
+BATCH_PATHS = frozenset({"/inventory/batch_adjust"})
+EXEMPT_PREFIXES = ("/admin",)
+
+
+class LimiterState(BaseModel):
+    limit: int
+    in_flight: int
+    queued: int
+    admitted: int
+    shed: int
+
+
+class AdmissionState(BaseModel):
+    limiters: Dict[str, LimiterState]
+    rate_limited: int
+    max_queue_wait_ms: int
+    max_batch_size: int
+    max_batch_bytes: int
+
+
+class ConcurrencyLimiter:
+    """Async semaphore with a bounded FIFO queue and a maximum queue time."""
+
+    def __init__(self, limit: int, max_queue: int, max_wait: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self._waiters: Deque[asyncio.Future] = collections.deque()
+
+    async def acquire(self) -> bool:
+        """Take a slot. Returns False if the request should be shed."""
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            self.shed += 1
+            return False
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        timer = loop.call_later(self.max_wait, self._expire, waiter)
+        try:
+            admitted = await waiter
+        except asyncio.CancelledError:
+            # Client went away; hand back a slot we may have been given meanwhile.
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                self.release()
+            else:
+                self._discard(waiter)
+            raise
+        finally:
+            timer.cancel()
+        if admitted:
+            self.admitted += 1
+        else:
+            self.shed += 1
+        return admitted
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)  # Hand our slot straight to the next waiter
+                return
+        self.in_flight -= 1
+
+    def _expire(self, waiter: asyncio.Future):
+        if not waiter.done():
+            waiter.set_result(False)
+            self._discard(waiter)
+
+    def _discard(self, waiter: asyncio.Future):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def state(self) -> LimiterState:
+        return LimiterState(
+            limit=self.limit,
+            in_flight=self.in_flight,
+            queued=len(self._waiters),
+            admitted=self.admitted,
+            shed=self.shed,
+        )
+
+
+LIMITERS = {
+    "reads": ConcurrencyLimiter(READ_CONCURRENCY, MAX_QUEUE, MAX_QUEUE_WAIT_SECONDS),
+    "writes": ConcurrencyLimiter(WRITE_CONCURRENCY, MAX_QUEUE, MAX_QUEUE_WAIT_SECONDS),
+}
+_rate_limited = 0
+
+
+def route_class(request: Request) -> str:
+    return "reads" if request.method in READ_METHODS else "writes"
+
+
+def admission_state() -> AdmissionState:
+    return AdmissionState(
+        limiters={name: limiter.state() for name, limiter in LIMITERS.items()},
+        rate_limited=_rate_limited,
+        max_queue_wait_ms=int(MAX_QUEUE_WAIT_SECONDS * 1000),
+        max_batch_size=MAX_BATCH_SIZE,
+        max_batch_bytes=MAX_BATCH_BYTES,
+    )
+
+
+def batch_too_large(request: Request) -> Optional[JSONResponse]:
+    """Reject an oversized batch from its headers, before FastAPI reads and validates the body."""
+    length = request.headers.get("content-length")
+    if length is None:
+        return JSONResponse({"detail": "Content-Length required for batch requests"}, status_code=411)
+    if not length.isdigit() or int(length) > MAX_BATCH_BYTES:
+        return JSONResponse(
+            {"detail": f"Batch too large: at most {MAX_BATCH_BYTES} bytes per request"},
+            status_code=413,
+        )
+    return None
+
+
+async def admission_control(request: Request, call_next):
+    global _rate_limited
+    if request.url.path.startswith(EXEMPT_PREFIXES):
+        return await call_next(request)
+
+    presented = request.headers.get(API_KEY_NAME)
+    api_key = API_KEYS.authenticate(presented) if presented else None
+    request.state.api_key = api_key
+    if api_key is None:
+        return JSONResponse({"detail": "Invalid or missing API Key"}, status_code=401)
+    if api_key.bucket is not None:
+        retry_after = api_key.bucket.try_acquire()
+        if retry_after:
+            _rate_limited += 1
+            return JSONResponse(
+                {"detail": "Rate limit exceeded"},
+                status_code=429,
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+    if request.method == "POST" and request.url.path in BATCH_PATHS:
+        rejection = batch_too_large(request)
+        if rejection is not None:
+            return rejection
+
+    limiter = LIMITERS[route_class(request)]
+    if not await limiter.acquire():
+        return JSONResponse(
+            {"detail": "Service overloaded, retry later"},
+            status_code=503,
+            headers={"Retry-After": "1"},
+        )
+    try:
+        return await call_next(request)
+    finally:
+        limiter.release()
@@ -1,16 +1,164 @@
-import os
-from fastapi import Security, HTTPException, status
-from fastapi.security.api_key import APIKeyHeader
-
-API_KEY = os.environ.get("INVENTORY_API_KEY")
-API_KEY_NAME = "X-API-Key"
-api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
-
-def get_api_key(api_key_header: str = Security(api_key_header)):
-    if api_key_header == API_KEY:
-        return api_key_header
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or missing API Key",
-        )
\ No newline at end of file
+"""API key authentication.
+
+Client keys are stored in the ``api_keys`` table as SHA-256 hashes together
+with their scopes (``read``, ``write``) and an optional token-bucket rate
+limit, which is enforced by the admission layer (``src/admission.py``).
+Keys without their own limit get ``API_KEY_DEFAULT_RATE`` /
+``API_KEY_DEFAULT_BURST`` when those are set. The table is loaded into an
+in-memory map at startup, so a request costs one hash and one dict lookup,
+never a database query. A trigger bumps ``api_key_revision`` on every
+change; a background task polls that counter every
+``RELOAD_INTERVAL_SECONDS`` and reloads without a restart.
+
+``INVENTORY_API_KEY``, when set, is accepted as a bootstrap key with both
+scopes and no rate limit.
+"""
+import hashlib
+import math
+import os
+import sqlite3
+from typing import Dict, FrozenSet, NamedTuple, Optional
+
+from fastapi import HTTPException, Request, Security, status
+from fastapi.security.api_key import APIKeyHeader
+
+from .ratelimit import TokenBucket
+
+API_KEY_NAME = "X-API-Key"
+api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
+
+READ_SCOPE = "read"
+WRITE_SCOPE = "write"
+ALL_SCOPES = frozenset({READ_SCOPE, WRITE_SCOPE})
+READ_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+RELOAD_INTERVAL_SECONDS = float(os.environ.get("API_KEY_RELOAD_INTERVAL_SECONDS", 5))
+DEFAULT_RATE_PER_SECOND = float(os.environ.get("API_KEY_DEFAULT_RATE", 0))
+DEFAULT_BURST = int(os.environ.get("API_KEY_DEFAULT_BURST", 0))
+
+
+def hash_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def register_key(
+    conn: sqlite3.Connection,
+    api_key: str,
+    client_id: str,
+    scopes=ALL_SCOPES,
+    rate_per_second: Optional[float] = None,
+    burst: Optional[int] = None,
+):
+    """Store (or replace) a client key. Only its hash is written to the database."""
+    unknown = set(scopes) - ALL_SCOPES
+    if unknown:
+        raise ValueError(f"Unknown scopes: {', '.join(sorted(unknown))}")
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO api_keys (key_hash, client_id, scopes, rate_per_second, burst, active) "
+            "VALUES (?, ?, ?, ?, ?, 1)",
+            (hash_key(api_key), client_id, ",".join(sorted(scopes)), rate_per_second, burst),
+        )
+
+
+def revoke_client(conn: sqlite3.Connection, client_id: str) -> int:
+    with conn:
+        return conn.execute("UPDATE api_keys SET active=0 WHERE client_id=? AND active=1", (client_id,)).rowcount
+
+
+class ApiKey(NamedTuple):
+    client_id: str
+    key_hash: str
+    scopes: FrozenSet[str]
+    bucket: Optional[TokenBucket] = None
+
+
+class KeyRegistry:
+    """In-memory map of hashed API keys, reloaded when the ``api_keys`` table changes."""
+
+    def __init__(self, bootstrap_key: Optional[str] = None):
+        self.bootstrap_key = bootstrap_key
+        self.database: Optional[str] = None
+        self._keys: Dict[str, ApiKey] = self._bootstrap_keys()
+        self._revision: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def load(self, database: str):
+        self.database = database
+        conn = sqlite3.connect(database)
+        try:
+            revision = conn.execute("SELECT revision FROM api_key_revision").fetchone()[0]
+            rows = conn.execute(
+                "SELECT key_hash, client_id, scopes, rate_per_second, burst FROM api_keys WHERE active=1"
+            ).fetchall()
+        finally:
+            conn.close()
+        keys = self._bootstrap_keys()
+        for key_hash, client_id, scopes, rate, burst in rows:
+            keys[key_hash] = ApiKey(
+                client_id,
+                key_hash,
+                frozenset(s for s in scopes.split(",") if s),
+                self._bucket_for(key_hash, rate, burst),
+            )
+        self._keys = keys
+        self._revision = revision
+
+    def _bootstrap_keys(self) -> Dict[str, ApiKey]:
+        if not self.bootstrap_key:
+            return {}
+        digest = hash_key(self.bootstrap_key)
+        return {digest: ApiKey("bootstrap", digest, ALL_SCOPES)}
+
+    def _bucket_for(self, key_hash: str, rate: Optional[float], burst: Optional[int]) -> Optional[TokenBucket]:
+        if not rate:
+            rate, burst = DEFAULT_RATE_PER_SECOND, DEFAULT_BURST
+        if not rate:
+            return None
+        burst = burst or max(1, math.ceil(rate))
+        previous = self._keys.get(key_hash)
+        # Keep the live bucket across reloads so a reload never refills it.
+        if previous and previous.bucket and (previous.bucket.rate, previous.bucket.burst) == (rate, burst):
+            return previous.bucket
+        return TokenBucket(rate, burst)
+
+    def reload_if_changed(self):
+        """Reload if the revision counter moved since the last load."""
+        if self.database is None:
+            return
+        conn = sqlite3.connect(self.database)
+        try:
+            revision = conn.execute("SELECT revision FROM api_key_revision").fetchone()[0]
+        finally:
+            conn.close()
+        if revision != self._revision:
+            self.load(self.database)
+
+    def authenticate(self, api_key: str) -> Optional[ApiKey]:
+        # The map is keyed by SHA-256 of the secret, so any timing difference in
+        # the dict lookup depends on the hash, which an attacker cannot steer
+        # byte by byte, not on how much of the secret they guessed right.
+        return self._keys.get(hash_key(api_key))
+
+
+API_KEYS = KeyRegistry(os.environ.get("INVENTORY_API_KEY"))
+
+
+def get_api_key(request: Request, api_key_header: Optional[str] = Security(api_key_header)) -> ApiKey:
+    if hasattr(request.state, "api_key"):
+        api_key = request.state.api_key  # Already authenticated by admission_control
+    else:
+        api_key = API_KEYS.authenticate(api_key_header) if api_key_header else None
+    if api_key is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or missing API Key",
+        )
+    scope = READ_SCOPE if request.method in READ_METHODS else WRITE_SCOPE
+    if scope not in api_key.scopes:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"API key lacks the '{scope}' scope",
+        )
+    return api_key
@@ -0,0 +1,88 @@
+"""Idempotency-Key support for inventory write endpoints.
+
+A client may send an ``Idempotency-Key`` header with a write. The first
+request stores its response under that key in the same transaction as the
+inventory change; a retry with the same key returns the stored bytes without
+touching inventory rows. Keys expire after ``TTL_SECONDS`` and the table is
+capped at ``MAX_KEYS`` rows; both are enforced by ``sweep``, which deletes in
+small batches so it never holds the write lock for long.
+"""
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Optional
+
+from fastapi import HTTPException
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 24 * 60 * 60))
+MAX_KEYS = int(os.environ.get("IDEMPOTENCY_MAX_KEYS", 100_000))
+SWEEP_INTERVAL_SECONDS = int(os.environ.get("IDEMPOTENCY_SWEEP_INTERVAL_SECONDS", 60))
+SWEEP_BATCH_SIZE = 500
+
+
+def fingerprint(endpoint: str, body: str) -> str:
+    return hashlib.sha256(f"{endpoint}\n{body}".encode("utf-8")).hexdigest()
+
+
+def begin(conn: sqlite3.Connection, key: str, request_fingerprint: str) -> Optional[bytes]:
+    """Open the write transaction and return the stored response for ``key``, if any.
+
+    The transaction is started with ``BEGIN IMMEDIATE`` so two concurrent
+    requests with the same key cannot both miss the lookup.
+    """
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters")
+    conn.execute("BEGIN IMMEDIATE")
+    row = conn.execute(
+        "SELECT fingerprint, response FROM idempotency_keys WHERE key=? AND created_at>=?",
+        (key, time.time() - TTL_SECONDS),
+    ).fetchone()
+    if row is None:
+        return None
+    if row[0] != request_fingerprint:
+        conn.rollback()
+        raise HTTPException(
+            status_code=422,
+            detail=f"{IDEMPOTENCY_HEADER} was already used for a different request",
+        )
+    return row[1]
+
+
+def record(conn: sqlite3.Connection, key: str, request_fingerprint: str, response: bytes):
+    """Store ``response`` for ``key``; must run before the write transaction commits."""
+    conn.execute(
+        "INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, response, created_at) VALUES (?, ?, ?, ?)",
+        (key, request_fingerprint, response, time.time()),
+    )
+
+
+def sweep(conn: sqlite3.Connection, batch_size: int = SWEEP_BATCH_SIZE) -> int:
+    """Delete expired keys, then the oldest keys beyond ``MAX_KEYS``. Returns rows deleted."""
+    deleted = 0
+    cutoff = time.time() - TTL_SECONDS
+    while True:
+        with conn:
+            removed = conn.execute(
+                "DELETE FROM idempotency_keys WHERE rowid IN "
+                "(SELECT rowid FROM idempotency_keys WHERE created_at<? LIMIT ?)",
+                (cutoff, batch_size),
+            ).rowcount
+        deleted += removed
+        if removed < batch_size:
+            break
+    excess = conn.execute("SELECT COUNT(*) FROM idempotency_keys").fetchone()[0] - MAX_KEYS
+    while excess > 0:
+        with conn:
+            removed = conn.execute(
+                "DELETE FROM idempotency_keys WHERE rowid IN "
+                "(SELECT rowid FROM idempotency_keys ORDER BY created_at LIMIT ?)",
+                (min(excess, batch_size),),
+            ).rowcount
+        deleted += removed
+        excess -= removed
+        if removed == 0:
+            break
+    return deleted
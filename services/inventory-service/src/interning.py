@@ -0,0 +1,63 @@
+"""In-memory intern maps for the ``skus`` and ``locations`` dictionary tables."""
+import sqlite3
+from typing import Dict, Optional
+
+
+class InternTable:
+    """Caches the string -> integer ID mapping of one dictionary table.
+
+    Only committed rows are cached. IDs created inside a transaction are
+    collected in a caller-owned ``pending`` dict and handed to ``remember``
+    after the commit, so an ID from a rolled-back insert never leaks into
+    the cache.
+    """
+
+    def __init__(self, table: str, column: str):
+        self.table = table
+        self.column = column
+        self._ids: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def load(self, conn: sqlite3.Connection):
+        rows = conn.execute(f"SELECT {self.column}, id FROM {self.table}").fetchall()
+        self._ids = dict(rows)
+
+    def lookup(self, conn: sqlite3.Connection, name: str, pending: Optional[Dict[str, int]] = None) -> Optional[int]:
+        """Return the ID for ``name``, or None if it has never been stored."""
+        if pending and name in pending:
+            return pending[name]
+        key_id = self._ids.get(name)
+        if key_id is None:
+            # Another worker process may have added it since we loaded.
+            row = conn.execute(
+                f"SELECT id FROM {self.table} WHERE {self.column}=?", (name,)
+            ).fetchone()
+            if row is None:
+                return None
+            key_id = self._ids[name] = row[0]
+        return key_id
+
+    def intern(self, conn: sqlite3.Connection, name: str, pending: Dict[str, int]) -> int:
+        """Return the ID for ``name``, inserting a dictionary row if needed."""
+        key_id = self.lookup(conn, name, pending)
+        if key_id is None:
+            conn.execute(f"INSERT OR IGNORE INTO {self.table} ({self.column}) VALUES (?)", (name,))
+            key_id = conn.execute(
+                f"SELECT id FROM {self.table} WHERE {self.column}=?", (name,)
+            ).fetchone()[0]
+            pending[name] = key_id
+        return key_id
+
+    def remember(self, pending: Dict[str, int]):
+        self._ids.update(pending)
+
+
+SKUS = InternTable("skus", "sku")
+LOCATIONS = InternTable("locations", "location")
+
+
+def load_intern_tables(conn: sqlite3.Connection):
+    SKUS.load(conn)
+    LOCATIONS.load(conn)
@@ -1,29 +1,18 @@
-import os
-import re
-from fastapi import FastAPI, HTTPException, Query, Security, status, Depends, Body
-from fastapi.security.api_key import APIKeyHeader
+import asyncio
+from fastapi import FastAPI, HTTPException, Query, Depends, Body, Header
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, RootModel
 from typing import Dict, List, Optional
 import sqlite3
-import httpx
 
-DATABASE = "inventory.db"
-
-# --- API Key Auth Dependency ---
-API_KEY = os.environ.get("INVENTORY_API_KEY")
-if not API_KEY:
-    raise RuntimeError("INVENTORY_API_KEY environment variable not set!")
-
-API_KEY_NAME = "X-API-Key"
-api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
+from . import admission, idempotency
+from .auth import API_KEYS, RELOAD_INTERVAL_SECONDS, get_api_key
+from .interning import LOCATIONS, SKUS, load_intern_tables
+from .schema import create_schema
+from .serialization import dumps, encode_rows, json_response
+from .skufilter import REBUILD_CHECK_INTERVAL_SECONDS, SKU_FILTER, SkuFilterStats
 
-def get_api_key(api_key_header: str = Security(api_key_header)):
-    if api_key_header == API_KEY:
-        return api_key_header
-    raise HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Invalid or missing API Key",
-    )
+DATABASE = "inventory.db"
 
 # --- FastAPI App ---
 app = FastAPI(
@@ -32,6 +21,7 @@ app = FastAPI(
     version="1.2.0",
     dependencies=[Depends(get_api_key)],  # Require API key globally
 )
+app.middleware("http")(admission.admission_control)
 
 class Stock(BaseModel):
     sku: str
@@ -59,6 +49,8 @@ class BatchAdjustmentResult(BaseModel):
     success: bool
     error: Optional[str] = None
 
+INVENTORY_FIELDS = ("sku", "location", "quantity")
+
 class WebhookRegistration(BaseModel):
     url: str
 
@@ -67,22 +59,95 @@ class WebhookList(BaseModel):
 
 def init_db():
     conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute(
-        "CREATE TABLE IF NOT EXISTS inventory (sku TEXT, location TEXT, quantity INTEGER, PRIMARY KEY(sku, location))"
-    )
-    c.execute(
-        "CREATE TABLE IF NOT EXISTS webhooks (url TEXT PRIMARY KEY)"
-    )
-    conn.commit()
-    conn.close()
+    try:
+        create_schema(conn)
+        load_intern_tables(conn)
+    finally:
+        conn.close()
+    # Built by sku_filter_maintainer once the app is serving.
+    SKU_FILTER.clear()
+    API_KEYS.load(DATABASE)
+
+def sweep_idempotency_keys():
+    conn = sqlite3.connect(DATABASE)
+    try:
+        idempotency.sweep(conn)
+    finally:
+        conn.close()
+
+async def idempotency_sweeper():
+    while True:
+        await asyncio.sleep(idempotency.SWEEP_INTERVAL_SECONDS)
+        try:
+            await run_in_threadpool(sweep_idempotency_keys)
+        except sqlite3.Error:
+            pass  # Retry on the next interval
+
+async def api_key_reloader():
+    while True:
+        await asyncio.sleep(RELOAD_INTERVAL_SECONDS)
+        try:
+            await run_in_threadpool(API_KEYS.reload_if_changed)
+        except sqlite3.Error:
+            pass  # Keep serving the keys we have
+
+def rebuild_sku_filter():
+    conn = sqlite3.connect(DATABASE)
+    try:
+        SKU_FILTER.rebuild(conn)
+    finally:
+        conn.close()
+
+async def sku_filter_maintainer():
+    # The first pass builds the filter right after startup.
+    while True:
+        if SKU_FILTER.needs_rebuild():
+            try:
+                await run_in_threadpool(rebuild_sku_filter)
+            except sqlite3.Error:
+                pass  # Retry on the next interval
+        await asyncio.sleep(REBUILD_CHECK_INTERVAL_SECONDS)
+
+_background_tasks = set()
 
 @app.on_event("startup")
 def startup():
     init_db()
 
+@app.on_event("startup")
+async def start_background_tasks():
+    for worker in (idempotency_sweeper, sku_filter_maintainer, api_key_reloader):
+        task = asyncio.create_task(worker())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+# --- Admission Control ---
+
+@app.get(
+    "/admin/limits",
+    response_model=admission.AdmissionState,
+    tags=["Admin"],
+    description="Current admission-control state: concurrency per route class, queue depth and shed/rate-limited counts."
+)
+def get_limits():
+    return admission.admission_state()
+
+@app.get(
+    "/admin/sku_filter",
+    response_model=SkuFilterStats,
+    tags=["Admin"],
+    description="Size, memory footprint and false-positive rate of the unknown-SKU Bloom filter."
+)
+def get_sku_filter_stats():
+    return SKU_FILTER.stats()
+
 # --- Webhook Utilities ---
 
+DISCORD_WEBHOOK_PREFIXES = (
+    "https://discord.com/api/webhooks/",
+    "https://discordapp.com/api/webhooks/",
+)
+
 def get_registered_webhooks() -> List[str]:
     conn = sqlite3.connect(DATABASE)
     c = conn.cursor()
@@ -95,10 +160,12 @@ def notify_webhooks(payload: dict):
     urls = get_registered_webhooks()
     if not urls:
         return
+    # Imported on first use: httpx (and certifi) add noticeably to cold start.
+    import httpx
     for url in urls:
         try:
             # If Discord webhook, format differently
-            if re.match(r"^https://(discord(app)?\.com|discord\.com)/api/webhooks/", url):
+            if url.startswith(DISCORD_WEBHOOK_PREFIXES):
                 content = (
                     f"Inventory Event: {payload.get('event')}\n"
                     f"SKU: {payload.get('sku')}\n"
@@ -154,7 +221,7 @@ def unregister_webhook(reg: WebhookRegistration):
     conn.close()
     return MessageResponse(detail="Webhook unregistered.")
 
-# --- Inventory Endpoints (unchanged except for adding notify_webhooks calls) ---
+# --- Inventory Endpoints ---
 
 @app.get(
     "/inventory",
@@ -175,24 +242,39 @@ def list_inventory(
     where = []
     params = []
     if sku:
-        where.append("sku=?")
-        params.append(sku)
+        sku_id = SKUS.lookup(conn, sku) if SKU_FILTER.might_contain(sku) else None
+        if sku_id is None:
+            conn.close()
+            return json_response(dumps([]))
+        where.append("i.sku_id=?")
+        params.append(sku_id)
     if location:
-        where.append("location=?")
-        params.append(location)
+        location_id = LOCATIONS.lookup(conn, location)
+        if location_id is None:
+            conn.close()
+            return json_response(dumps([]))
+        where.append("i.location_id=?")
+        params.append(location_id)
     if min_quantity is not None:
-        where.append("quantity>=?")
+        where.append("i.quantity>=?")
         params.append(min_quantity)
     if max_quantity is not None:
-        where.append("quantity<=?")
+        where.append("i.quantity<=?")
         params.append(max_quantity)
     where_clause = " WHERE " + " AND ".join(where) if where else ""
-    sql = f"SELECT sku, location, quantity FROM inventory{where_clause} LIMIT ? OFFSET ?"
+    # Page over the narrow integer table first and only join the matching page
+    # back to the dictionary tables, so skipped rows never pay for the join.
+    sql = (
+        "SELECT s.sku, l.location, p.quantity FROM "
+        f"(SELECT sku_id, location_id, quantity FROM inventory i{where_clause} LIMIT ? OFFSET ?) p "
+        "JOIN skus s ON s.id = p.sku_id JOIN locations l ON l.id = p.location_id"
+    )
     params.extend([limit, offset])
     c.execute(sql, tuple(params))
     rows = c.fetchall()
     conn.close()
-    return [InventoryItem(sku=row[0], location=row[1], quantity=row[2]) for row in rows]
+    # Rows are encoded straight to JSON; response_model only drives the OpenAPI schema.
+    return json_response(encode_rows(rows, INVENTORY_FIELDS))
 
 @app.get(
     "/inventory/{sku}",
@@ -201,10 +283,19 @@ def list_inventory(
     description="Get all locations and quantities for a given SKU."
 )
 def get_inventory(sku: str):
+    if not SKU_FILTER.might_contain(sku):
+        raise HTTPException(status_code=404, detail="SKU not found")
     conn = sqlite3.connect(DATABASE)
     c = conn.cursor()
-    c.execute("SELECT location, quantity FROM inventory WHERE sku=?", (sku,))
-    rows = c.fetchall()
+    sku_id = SKUS.lookup(conn, sku)
+    rows = []
+    if sku_id is not None:
+        c.execute(
+            "SELECT l.location, i.quantity FROM inventory i "
+            "JOIN locations l ON l.id = i.location_id WHERE i.sku_id=?",
+            (sku_id,),
+        )
+        rows = c.fetchall()
     conn.close()
     if not rows:
         raise HTTPException(status_code=404, detail="SKU not found")
@@ -216,34 +307,59 @@ def get_inventory(sku: str):
     tags=["Inventory Adjustment"],
     description="Adjust inventory for a SKU/location by a quantity amount (positive or negative)."
 )
-def adjust_inventory(sku: str, stock: Stock):
+def adjust_inventory(
+    sku: str,
+    stock: Stock,
+    idempotency_key: Optional[str] = Header(None, alias=idempotency.IDEMPOTENCY_HEADER),
+):
     conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute(
-        "SELECT quantity FROM inventory WHERE sku=? AND location=?", (sku, stock.location)
-    )
-    row = c.fetchone()
-    if row:
-        new_quantity = row[0] + stock.quantity
-        if new_quantity < 0:
-            conn.close()
-            raise HTTPException(status_code=400, detail="Insufficient stock")
-        c.execute(
-            "UPDATE inventory SET quantity=? WHERE sku=? AND location=?",
-            (new_quantity, sku, stock.location),
-        )
-        returned_quantity = new_quantity
-    else:
-        if stock.quantity < 0:
-            conn.close()
-            raise HTTPException(status_code=400, detail="Insufficient stock")
-        c.execute(
-            "INSERT INTO inventory (sku, location, quantity) VALUES (?, ?, ?)",
-            (sku, stock.location, stock.quantity),
-        )
-        returned_quantity = stock.quantity
-    conn.commit()
-    conn.close()
+    try:
+        c = conn.cursor()
+        if idempotency_key:
+            fingerprint = idempotency.fingerprint(f"adjust/{sku}", stock.model_dump_json())
+            stored = idempotency.begin(conn, idempotency_key, fingerprint)
+            if stored is not None:
+                return json_response(stored)
+        new_skus, new_locations = {}, {}
+        inserted = False
+        sku_id = SKUS.lookup(conn, sku)
+        location_id = LOCATIONS.lookup(conn, stock.location)
+        row = None
+        if sku_id is not None and location_id is not None:
+            c.execute(
+                "SELECT quantity FROM inventory WHERE sku_id=? AND location_id=?", (sku_id, location_id)
+            )
+            row = c.fetchone()
+        if row:
+            new_quantity = row[0] + stock.quantity
+            if new_quantity < 0:
+                raise HTTPException(status_code=400, detail="Insufficient stock")
+            c.execute(
+                "UPDATE inventory SET quantity=? WHERE sku_id=? AND location_id=?",
+                (new_quantity, sku_id, location_id),
+            )
+            returned_quantity = new_quantity
+        else:
+            if stock.quantity < 0:
+                raise HTTPException(status_code=400, detail="Insufficient stock")
+            sku_id = SKUS.intern(conn, sku, new_skus)
+            location_id = LOCATIONS.intern(conn, stock.location, new_locations)
+            c.execute(
+                "INSERT INTO inventory (sku_id, location_id, quantity) VALUES (?, ?, ?)",
+                (sku_id, location_id, stock.quantity),
+            )
+            returned_quantity = stock.quantity
+            inserted = True
+        body = dumps({"sku": sku, "location": stock.location, "quantity": returned_quantity})
+        if idempotency_key:
+            idempotency.record(conn, idempotency_key, fingerprint, body)
+        conn.commit()
+    finally:
+        conn.close()
+    SKUS.remember(new_skus)
+    LOCATIONS.remember(new_locations)
+    if inserted:
+        SKU_FILTER.add(sku)
     # Notify webhooks
     notify_webhooks({
         "event": "inventory_adjusted",
@@ -252,7 +368,17 @@ def adjust_inventory(sku: str, stock: Stock):
         "quantity": returned_quantity,
         "adjustment": stock.quantity
     })
-    return InventoryItem(sku=sku, location=stock.location, quantity=returned_quantity)
+    return json_response(body)
+
+def batch_result(stock: Stock, quantity: Optional[int] = None, error: Optional[str] = None) -> dict:
+    """Plain-dict equivalent of ``BatchAdjustmentResult``, without model construction."""
+    return {
+        "sku": stock.sku,
+        "location": stock.location,
+        "quantity": quantity,
+        "success": error is None,
+        "error": error,
+    }
 
 @app.post(
     "/inventory/batch_adjust",
@@ -260,72 +386,83 @@ def adjust_inventory(sku: str, stock: Stock):
     tags=["Inventory Adjustment"],
     description="Batch adjust inventory for multiple SKU/location pairs. Returns per-item success/errors."
 )
-def batch_adjust_inventory(adjustments: BatchStock = Body(...)):
+def batch_adjust_inventory(
+    adjustments: BatchStock = Body(...),
+    idempotency_key: Optional[str] = Header(None, alias=idempotency.IDEMPOTENCY_HEADER),
+):
+    if len(adjustments.root) > admission.MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: at most {admission.MAX_BATCH_SIZE} adjustments per request",
+        )
     results = []
     conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    notifications = []
-    for stock in adjustments.root:
-        try:
-            c.execute(
-                "SELECT quantity FROM inventory WHERE sku=? AND location=?",
-                (stock.sku, stock.location)
-            )
-            row = c.fetchone()
-            if row:
-                new_quantity = row[0] + stock.quantity
-                if new_quantity < 0:
-                    results.append(BatchAdjustmentResult(
-                        sku=stock.sku,
-                        location=stock.location,
-                        success=False,
-                        error="Insufficient stock"
-                    ))
-                    continue
-                c.execute(
-                    "UPDATE inventory SET quantity=? WHERE sku=? AND location=?",
-                    (new_quantity, stock.sku, stock.location)
-                )
-                returned_quantity = new_quantity
-            else:
-                if stock.quantity < 0:
-                    results.append(BatchAdjustmentResult(
-                        sku=stock.sku,
-                        location=stock.location,
-                        success=False,
-                        error="Insufficient stock"
-                    ))
-                    continue
-                c.execute(
-                    "INSERT INTO inventory (sku, location, quantity) VALUES (?, ?, ?)",
-                    (stock.sku, stock.location, stock.quantity)
-                )
-                returned_quantity = stock.quantity
-            results.append(BatchAdjustmentResult(
-                sku=stock.sku,
-                location=stock.location,
-                quantity=returned_quantity,
-                success=True
-            ))
-            notifications.append({
-                "event": "inventory_adjusted",
-                "sku": stock.sku,
-                "location": stock.location,
-                "quantity": returned_quantity,
-                "adjustment": stock.quantity
-            })
-        except Exception as e:
-            results.append(BatchAdjustmentResult(
-                sku=stock.sku,
-                location=stock.location,
-                success=False,
-                error=str(e)
-            ))
-    conn.commit()
-    conn.close()
+    try:
+        c = conn.cursor()
+        if idempotency_key:
+            fingerprint = idempotency.fingerprint("batch_adjust", adjustments.model_dump_json())
+            stored = idempotency.begin(conn, idempotency_key, fingerprint)
+            if stored is not None:
+                return json_response(stored)
+        notifications = []
+        inserted_skus = []
+        new_skus, new_locations = {}, {}
+        for stock in adjustments.root:
+            try:
+                sku_id = SKUS.lookup(conn, stock.sku, new_skus)
+                location_id = LOCATIONS.lookup(conn, stock.location, new_locations)
+                row = None
+                if sku_id is not None and location_id is not None:
+                    c.execute(
+                        "SELECT quantity FROM inventory WHERE sku_id=? AND location_id=?",
+                        (sku_id, location_id)
+                    )
+                    row = c.fetchone()
+                if row:
+                    new_quantity = row[0] + stock.quantity
+                    if new_quantity < 0:
+                        results.append(batch_result(stock, error="Insufficient stock"))
+                        continue
+                    c.execute(
+                        "UPDATE inventory SET quantity=? WHERE sku_id=? AND location_id=?",
+                        (new_quantity, sku_id, location_id)
+                    )
+                    returned_quantity = new_quantity
+                else:
+                    if stock.quantity < 0:
+                        results.append(batch_result(stock, error="Insufficient stock"))
+                        continue
+                    sku_id = SKUS.intern(conn, stock.sku, new_skus)
+                    location_id = LOCATIONS.intern(conn, stock.location, new_locations)
+                    c.execute(
+                        "INSERT INTO inventory (sku_id, location_id, quantity) VALUES (?, ?, ?)",
+                        (sku_id, location_id, stock.quantity)
+                    )
+                    returned_quantity = stock.quantity
+                    inserted_skus.append(stock.sku)
+                results.append(batch_result(stock, quantity=returned_quantity))
+                notifications.append({
+                    "event": "inventory_adjusted",
+                    "sku": stock.sku,
+                    "location": stock.location,
+                    "quantity": returned_quantity,
+                    "adjustment": stock.quantity
+                })
+            except Exception as e:
+                results.append(batch_result(stock, error=str(e)))
+        body = dumps(results)
+        if idempotency_key:
+            idempotency.record(conn, idempotency_key, fingerprint, body)
+        conn.commit()
+    finally:
+        conn.close()
+    SKUS.remember(new_skus)
+    LOCATIONS.remember(new_locations)
+    for inserted_sku in inserted_skus:
+        SKU_FILTER.add(inserted_sku)
     for note in notifications:
         notify_webhooks(note)
-    return results
+    return json_response(body)
 
 @app.delete(
     "/inventory/{sku}",
@@ -334,14 +471,19 @@ def batch_adjust_inventory(adjustments: BatchStock = Body(...)):
     description="Delete all inventory entries for a specific SKU."
 )
 def delete_sku(sku: str):
+    if not SKU_FILTER.might_contain(sku):
+        raise HTTPException(status_code=404, detail="SKU not found")
     conn = sqlite3.connect(DATABASE)
     c = conn.cursor()
-    c.execute("DELETE FROM inventory WHERE sku=?", (sku,))
+    sku_id = SKUS.lookup(conn, sku)
+    if sku_id is not None:
+        c.execute("DELETE FROM inventory WHERE sku_id=?", (sku_id,))
     changes = conn.total_changes
     conn.commit()
     conn.close()
     if changes == 0:
         raise HTTPException(status_code=404, detail="SKU not found")
+    SKU_FILTER.note_delete()
     notify_webhooks({
         "event": "inventory_deleted",
         "sku": sku,
@@ -355,14 +497,20 @@ def delete_sku(sku: str):
     description="Delete inventory for a SKU at a specific location."
 )
 def delete_sku_location(sku: str, location: str):
+    if not SKU_FILTER.might_contain(sku):
+        raise HTTPException(status_code=404, detail="SKU/location not found")
     conn = sqlite3.connect(DATABASE)
     c = conn.cursor()
-    c.execute("DELETE FROM inventory WHERE sku=? AND location=?", (sku, location))
+    sku_id = SKUS.lookup(conn, sku)
+    location_id = LOCATIONS.lookup(conn, location)
+    if sku_id is not None and location_id is not None:
+        c.execute("DELETE FROM inventory WHERE sku_id=? AND location_id=?", (sku_id, location_id))
     changes = conn.total_changes
     conn.commit()
     conn.close()
     if changes == 0:
         raise HTTPException(status_code=404, detail="SKU/location not found")
+    SKU_FILTER.note_delete()
     notify_webhooks({
         "event": "inventory_deleted",
         "sku": sku,
@@ -0,0 +1,111 @@
+"""SQLite schema for the inventory service.
+
+SKUs and locations are stored once in small dictionary tables and the hot
+``inventory`` table only holds integer ID pairs. Databases created before the
+dictionary tables existed are migrated in place by
+``migrate_legacy_inventory``.
+
+The schema version is kept in ``PRAGMA user_version``. Startup only reads
+that pragma; DDL and migrations run when it is behind ``SCHEMA_VERSION``.
+Bump ``SCHEMA_VERSION`` and append to ``MIGRATIONS`` for every schema change.
+"""
+import sqlite3
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS skus (id INTEGER PRIMARY KEY, sku TEXT NOT NULL UNIQUE)",
+    "CREATE TABLE IF NOT EXISTS locations (id INTEGER PRIMARY KEY, location TEXT NOT NULL UNIQUE)",
+    (
+        "CREATE TABLE IF NOT EXISTS inventory ("
+        "sku_id INTEGER NOT NULL REFERENCES skus(id), "
+        "location_id INTEGER NOT NULL REFERENCES locations(id), "
+        "quantity INTEGER, "
+        "PRIMARY KEY(sku_id, location_id)) WITHOUT ROWID"
+    ),
+    "CREATE INDEX IF NOT EXISTS idx_inventory_location ON inventory(location_id)",
+    "CREATE TABLE IF NOT EXISTS webhooks (url TEXT PRIMARY KEY)",
+    (
+        "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+        "key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, response BLOB NOT NULL, created_at REAL NOT NULL)"
+    ),
+    "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys(created_at)",
+    (
+        "CREATE TABLE IF NOT EXISTS api_keys ("
+        "key_hash TEXT PRIMARY KEY, client_id TEXT NOT NULL, scopes TEXT NOT NULL, "
+        "rate_per_second REAL, burst INTEGER, active INTEGER NOT NULL DEFAULT 1)"
+    ),
+    "CREATE TABLE IF NOT EXISTS api_key_revision (id INTEGER PRIMARY KEY CHECK (id = 0), revision INTEGER NOT NULL)",
+    "INSERT OR IGNORE INTO api_key_revision (id, revision) VALUES (0, 0)",
+] + [
+    f"CREATE TRIGGER IF NOT EXISTS api_keys_{event.lower()} AFTER {event} ON api_keys "
+    "BEGIN UPDATE api_key_revision SET revision = revision + 1; END"
+    for event in ("INSERT", "UPDATE", "DELETE")
+]
+
+
+def has_legacy_inventory(conn: sqlite3.Connection) -> bool:
+    """True when ``inventory`` still has the old ``(sku, location, quantity)`` text layout."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(inventory)")}
+    return "sku" in columns
+
+
+def copy_legacy_inventory(conn: sqlite3.Connection):
+    """Move the rows of ``inventory_legacy`` into the interned tables and drop it."""
+    conn.execute(
+        "INSERT OR IGNORE INTO skus (sku) SELECT DISTINCT sku FROM inventory_legacy ORDER BY sku"
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO locations (location) "
+        "SELECT DISTINCT location FROM inventory_legacy ORDER BY location"
+    )
+    conn.execute(
+        "INSERT INTO inventory (sku_id, location_id, quantity) "
+        "SELECT s.id, l.id, i.quantity FROM inventory_legacy i "
+        "JOIN skus s ON s.sku = i.sku "
+        "JOIN locations l ON l.location = i.location"
+    )
+    conn.execute("DROP TABLE inventory_legacy")
+
+
+def migrate_legacy_inventory(conn: sqlite3.Connection):
+    """Rewrite a text-keyed ``inventory`` table into the interned layout.
+
+    Must run inside the transaction opened by ``create_schema`` so the
+    rename is rolled back if the copy fails.
+    """
+    conn.execute("ALTER TABLE inventory RENAME TO inventory_legacy")
+    for statement in SCHEMA:
+        conn.execute(statement)
+    copy_legacy_inventory(conn)
+
+
+def migrate_to_v1(conn: sqlite3.Connection):
+    if has_legacy_inventory(conn):
+        migrate_legacy_inventory(conn)
+    for statement in SCHEMA:
+        conn.execute(statement)
+
+
+# MIGRATIONS[n] upgrades a database from user_version n to n + 1.
+MIGRATIONS = [migrate_to_v1]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def create_schema(conn: sqlite3.Connection):
+    version = schema_version(conn)
+    for migrate in MIGRATIONS[version:]:
+        # sqlite3 does not open a transaction before DDL on its own, so begin
+        # one explicitly: each migration and its version bump commit together.
+        conn.execute("BEGIN")
+        try:
+            migrate(conn)
+            version += 1
+            # PRAGMA user_version cannot be bound as a parameter.
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
@@ -0,0 +1,34 @@
+"""Lean JSON encoding for hot endpoints.
+
+Endpoints that return large lists encode SQLite rows straight to JSON bytes
+and return them with ``json_response``. FastAPI passes a ``Response``
+through untouched, so the route's ``response_model`` is still used for the
+OpenAPI schema but no per-row Pydantic model is built or validated.
+
+``orjson`` is used when installed; otherwise the stdlib encoder is used.
+"""
+import json
+from typing import Any, Iterable, Sequence
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_rows(rows: Iterable[Sequence[Any]], fields: Sequence[str]) -> bytes:
+    """Encode row tuples as a JSON array of objects keyed by ``fields``."""
+    return dumps([dict(zip(fields, row)) for row in rows])
+
+
+def json_response(body: bytes) -> Response:
+    """Wrap already-encoded JSON bytes without re-serializing them."""
+    return Response(content=body, media_type="application/json")
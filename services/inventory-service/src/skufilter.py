@@ -0,0 +1,186 @@
+"""Bloom-filter negative cache for SKU lookups.
+
+``SKU_FILTER`` holds every SKU that has at least one inventory row. A miss
+means the SKU certainly does not exist, so ``GET /inventory/{sku}`` and the
+delete endpoints can answer 404 without opening the database. A hit may be
+a false positive (about ``SKU_FILTER_FP_RATE``) and falls through to the
+normal query.
+
+The filter is built in the background after startup so a large catalogue
+does not delay the first request; until then every lookup falls through to
+the database. Inserts are added as they commit. Deletes cannot be removed
+from a Bloom filter, so they are counted and the filter is rebuilt from the
+database in the background once ``SKU_FILTER_REBUILD_AFTER_DELETES``
+accumulate or it grows past its sized capacity.
+
+The filter only sees writes made by this process. It is also rebuilt once it
+is ``SKU_FILTER_MAX_AGE_SECONDS`` old, so with several worker processes on
+one database a SKU created by another worker 404s here for at most that long
+(plus one check interval). Set ``SKU_FILTER_ENABLED=0`` if that is too long.
+"""
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+ENABLED = os.environ.get("SKU_FILTER_ENABLED", "1") != "0"
+FP_RATE = float(os.environ.get("SKU_FILTER_FP_RATE", 0.01))
+REBUILD_AFTER_DELETES = int(os.environ.get("SKU_FILTER_REBUILD_AFTER_DELETES", 1000))
+REBUILD_CHECK_INTERVAL_SECONDS = int(os.environ.get("SKU_FILTER_REBUILD_CHECK_INTERVAL_SECONDS", 30))
+MAX_AGE_SECONDS = int(os.environ.get("SKU_FILTER_MAX_AGE_SECONDS", 300))
+MIN_CAPACITY = 1024
+# Size for twice the current SKU count so inserts have headroom before a rebuild.
+GROWTH_FACTOR = 2
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, fp_rate: float):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def estimated_fp_rate(self, items: int) -> float:
+        return (1 - math.exp(-self.hash_count * items / self.size)) ** self.hash_count
+
+
+class SkuFilterStats(BaseModel):
+    enabled: bool
+    items: int
+    capacity: int
+    bits: int
+    hash_functions: int
+    memory_bytes: int
+    target_fp_rate: float
+    estimated_fp_rate: float
+    deletes_since_rebuild: int
+    negative_lookups: int
+    rebuilds: int
+    last_rebuild_ms: float
+    age_seconds: float
+
+
+class SkuFilter:
+    def __init__(self, enabled: bool = ENABLED, fp_rate: float = FP_RATE):
+        self.enabled = enabled
+        self.fp_rate = fp_rate
+        self.negative_lookups = 0
+        self.rebuilds = 0
+        self.last_rebuild_ms = 0.0
+        self._filter: Optional[BloomFilter] = None
+        self._items = 0
+        self._deletes = 0
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+        self._added_during_rebuild: Optional[List[str]] = None
+
+    def might_contain(self, sku: str) -> bool:
+        bloom = self._filter
+        if not self.enabled or bloom is None or sku in bloom:
+            return True
+        self.negative_lookups += 1
+        return False
+
+    def add(self, sku: str):
+        """Record a SKU whose inventory row has just been committed.
+
+        Called once per new SKU/location row, so SKUs already in the filter
+        are not counted again.
+        """
+        with self._lock:
+            if self._filter is not None and sku not in self._filter:
+                self._filter.add(sku)
+                self._items += 1
+            if self._added_during_rebuild is not None:
+                self._added_during_rebuild.append(sku)
+
+    def note_delete(self):
+        self._deletes += 1
+
+    def needs_rebuild(self) -> bool:
+        bloom = self._filter
+        return self.enabled and (
+            bloom is None
+            or self._deletes >= REBUILD_AFTER_DELETES
+            or self._items > bloom.capacity
+            or time.monotonic() - self._built_at >= MAX_AGE_SECONDS
+        )
+
+    def clear(self):
+        """Drop the filter (e.g. when the database is replaced); lookups fall through until rebuilt."""
+        with self._lock:
+            self._filter = None
+            self._items = 0
+            self._deletes = 0
+
+    def rebuild(self, conn: sqlite3.Connection):
+        """Build a fresh filter from the database and swap it in."""
+        if not self.enabled:
+            return
+        start = time.perf_counter()
+        with self._lock:
+            # SKUs committed after our SELECT starts are replayed from this list.
+            self._added_during_rebuild = []
+            deletes = self._deletes
+        try:
+            skus = [row[0] for row in conn.execute(
+                "SELECT s.sku FROM skus s WHERE EXISTS (SELECT 1 FROM inventory i WHERE i.sku_id = s.id)"
+            )]
+            bloom = BloomFilter(max(MIN_CAPACITY, len(skus) * GROWTH_FACTOR), self.fp_rate)
+            for sku in skus:
+                bloom.add(sku)
+            items = len(skus)
+            with self._lock:
+                for sku in self._added_during_rebuild:
+                    if sku not in bloom:
+                        bloom.add(sku)
+                        items += 1
+                self._items = items
+                self._filter = bloom
+                self._built_at = time.monotonic()
+                self._deletes -= deletes
+        finally:
+            with self._lock:
+                self._added_during_rebuild = None
+        self.rebuilds += 1
+        self.last_rebuild_ms = (time.perf_counter() - start) * 1000
+
+    def stats(self) -> SkuFilterStats:
+        bloom = self._filter
+        return SkuFilterStats(
+            enabled=self.enabled,
+            items=self._items,
+            capacity=bloom.capacity if bloom else 0,
+            bits=bloom.size if bloom else 0,
+            hash_functions=bloom.hash_count if bloom else 0,
+            memory_bytes=len(bloom.bits) if bloom else 0,
+            target_fp_rate=self.fp_rate,
+            estimated_fp_rate=bloom.estimated_fp_rate(self._items) if bloom else 0.0,
+            deletes_since_rebuild=self._deletes,
+            negative_lookups=self.negative_lookups,
+            rebuilds=self.rebuilds,
+            last_rebuild_ms=self.last_rebuild_ms,
+            age_seconds=time.monotonic() - self._built_at if bloom else 0.0,
+        )
+
+
+SKU_FILTER = SkuFilter()
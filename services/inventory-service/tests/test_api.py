@@ -1,7 +1,11 @@
 import os
+import sqlite3
 import pytest
 from fastapi.testclient import TestClient
-from src.main import app, init_db, DATABASE
+import asyncio
+from src import admission, auth, idempotency, schema, skufilter
+from src.main import app, init_db, rebuild_sku_filter, DATABASE
+from src.schema import SCHEMA_VERSION, create_schema, schema_version
 
 client = TestClient(app)
 API_KEY = os.environ.get("INVENTORY_API_KEY", "testkey")
@@ -76,6 +80,11 @@ def test_inventory_list_parametrized(seed_inventory, query, expected_count, fiel
         if "quantity_max" in field_checks:
             assert r["quantity"] <= field_checks["quantity_max"]
 
+def test_list_inventory_unknown_location(seed_inventory):
+    resp = client.get("/inventory?location=nowhere", headers=api_headers())
+    assert resp.status_code == 200
+    assert resp.json() == []
+
 def test_list_inventory_empty():
     resp = client.get("/inventory", headers=api_headers())
     assert resp.status_code == 200
@@ -132,6 +141,24 @@ def test_batch_adjust_inventory():
     assert results[2]["success"] is False
     assert results[3]["success"] is True
 
+def test_batch_adjust_result_shape():
+    batch = [
+        {"sku": "BATCH1", "location": "loc1", "quantity": 4},
+        {"sku": "BATCH2", "location": "loc2", "quantity": -1},
+    ]
+    resp = client.post("/inventory/batch_adjust", json=batch, headers=api_headers())
+    assert resp.json() == [
+        {"sku": "BATCH1", "location": "loc1", "quantity": 4, "success": True, "error": None},
+        {"sku": "BATCH2", "location": "loc2", "quantity": None, "success": False, "error": "Insufficient stock"},
+    ]
+
+def test_openapi_keeps_response_models():
+    openapi = client.get("/openapi.json", headers=api_headers()).json()
+    list_schema = openapi["paths"]["/inventory"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    batch_schema = openapi["paths"]["/inventory/batch_adjust"]["post"]["responses"]["200"]["content"]["application/json"]["schema"]
+    assert list_schema["items"]["$ref"].endswith("/InventoryItem")
+    assert batch_schema["items"]["$ref"].endswith("/BatchAdjustmentResult")
+
 # --- Test Delete ---
 
 def test_delete_sku(seed_inventory):
@@ -152,4 +179,294 @@ def test_delete_sku_location(seed_inventory):
 
 def test_delete_sku_location_not_found():
     resp = client.delete("/inventory/FOO/loc999", headers=api_headers())
-    assert resp.status_code == 404
\ No newline at end of file
+    assert resp.status_code == 404
+
+# --- Test Idempotency-Key ---
+
+def test_adjust_idempotency_key_replays_response():
+    body = {"sku": "SKU_I", "location": "locI", "quantity": 5}
+    headers = {**api_headers(), "Idempotency-Key": "adjust-1"}
+    first = client.post("/inventory/SKU_I/adjust", json=body, headers=headers)
+    retry = client.post("/inventory/SKU_I/adjust", json=body, headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json() == {"sku": "SKU_I", "location": "locI", "quantity": 5}
+    assert client.get("/inventory/SKU_I", headers=api_headers()).json() == {"locI": 5}
+
+def test_idempotency_key_reused_for_different_request():
+    headers = {**api_headers(), "Idempotency-Key": "adjust-2"}
+    client.post("/inventory/SKU_I/adjust", json={"sku": "SKU_I", "location": "locI", "quantity": 5}, headers=headers)
+    resp = client.post("/inventory/SKU_I/adjust", json={"sku": "SKU_I", "location": "locI", "quantity": 6}, headers=headers)
+    assert resp.status_code == 422
+
+def test_batch_adjust_idempotency_key_replays_response():
+    batch = [{"sku": "SKU_J", "location": "loc1", "quantity": 10}, {"sku": "SKU_J", "location": "loc1", "quantity": -4}]
+    headers = {**api_headers(), "Idempotency-Key": "batch-1"}
+    first = client.post("/inventory/batch_adjust", json=batch, headers=headers)
+    retry = client.post("/inventory/batch_adjust", json=batch, headers=headers)
+    assert retry.json() == first.json()
+    assert client.get("/inventory/SKU_J", headers=api_headers()).json() == {"loc1": 6}
+
+class TrackedConnection(sqlite3.Connection):
+    closed = False
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+def test_idempotency_key_errors_close_connection(monkeypatch):
+    opened = []
+    connect = sqlite3.connect
+    def tracking_connect(*args, **kwargs):
+        conn = connect(*args, factory=TrackedConnection, **kwargs)
+        opened.append(conn)
+        return conn
+    monkeypatch.setattr(sqlite3, "connect", tracking_connect)
+    item = {"sku": "SKU_K", "location": "loc1", "quantity": 1}
+    long_key = {**api_headers(), "Idempotency-Key": "k" * 300}
+    assert client.post("/inventory/SKU_K/adjust", json=item, headers=long_key).status_code == 400
+    assert client.post("/inventory/batch_adjust", json=[item], headers=long_key).status_code == 400
+    headers = {**api_headers(), "Idempotency-Key": "batch-2"}
+    client.post("/inventory/batch_adjust", json=[item], headers=headers)
+    resp = client.post("/inventory/batch_adjust", json=[{**item, "quantity": 2}], headers=headers)
+    assert resp.status_code == 422
+    assert opened and all(conn.closed for conn in opened)
+
+def test_idempotency_sweep_removes_expired_keys(monkeypatch):
+    headers = {**api_headers(), "Idempotency-Key": "old"}
+    client.post("/inventory/SKU_K/adjust", json={"sku": "SKU_K", "location": "loc1", "quantity": 1}, headers=headers)
+    monkeypatch.setattr(idempotency, "TTL_SECONDS", -1)
+    conn = sqlite3.connect(DATABASE)
+    try:
+        assert idempotency.sweep(conn, batch_size=1) == 1
+        assert conn.execute("SELECT COUNT(*) FROM idempotency_keys").fetchone()[0] == 0
+    finally:
+        conn.close()
+
+# --- Test API key registry ---
+
+def register_client_key(api_key, client_id, scopes, rate=None, burst=None):
+    conn = sqlite3.connect(DATABASE)
+    try:
+        auth.register_key(conn, api_key, client_id, scopes, rate, burst)
+    finally:
+        conn.close()
+
+def test_missing_or_unknown_api_key():
+    admitted = admission.LIMITERS["reads"].admitted
+    assert client.get("/inventory").status_code == 401
+    assert client.get("/inventory", headers={"X-API-Key": "nope"}).status_code == 401
+    # Rejected before taking a concurrency slot.
+    assert admission.LIMITERS["reads"].admitted == admitted
+
+def test_registered_key_is_picked_up_without_restart():
+    register_client_key("storefront-key", "storefront", {"read"})
+    auth.API_KEYS.reload_if_changed()  # One tick of api_key_reloader
+    headers = {"X-API-Key": "storefront-key"}
+    assert client.get("/inventory", headers=headers).status_code == 200
+    body = {"sku": "SKU_A", "location": "loc1", "quantity": 1}
+    resp = client.post("/inventory/SKU_A/adjust", json=body, headers=headers)
+    assert resp.status_code == 403
+    conn = sqlite3.connect(DATABASE)
+    auth.revoke_client(conn, "storefront")
+    conn.close()
+    auth.API_KEYS.reload_if_changed()
+    assert client.get("/inventory", headers=headers).status_code == 401
+
+def test_api_key_rate_limit():
+    register_client_key("erp-key", "erp", {"read", "write"}, rate=0.01, burst=2)
+    auth.API_KEYS.reload_if_changed()
+    headers = {"X-API-Key": "erp-key"}
+    assert client.get("/inventory", headers=headers).status_code == 200
+    assert client.get("/inventory", headers=headers).status_code == 200
+    resp = client.get("/inventory", headers=headers)
+    assert resp.status_code == 429
+    assert int(resp.headers["Retry-After"]) > 0
+
+# --- Test admission control ---
+
+def test_batch_adjust_rejects_oversized_batch(monkeypatch):
+    monkeypatch.setattr(admission, "MAX_BATCH_SIZE", 2)
+    batch = [{"sku": "B", "location": "loc1", "quantity": 1}] * 3
+    resp = client.post("/inventory/batch_adjust", json=batch, headers=api_headers())
+    assert resp.status_code == 413
+
+def test_api_key_is_authenticated_once_per_request(monkeypatch):
+    calls = []
+    authenticate = auth.API_KEYS.authenticate
+    def counting_authenticate(api_key):
+        calls.append(api_key)
+        return authenticate(api_key)
+    monkeypatch.setattr(auth.API_KEYS, "authenticate", counting_authenticate)
+    assert client.get("/inventory", headers=api_headers()).status_code == 200
+    assert calls == [API_KEY]
+
+def test_batch_adjust_rejects_oversized_body_before_parsing(monkeypatch):
+    monkeypatch.setattr(admission, "MAX_BATCH_BYTES", 100)
+    batch = [{"sku": "B", "location": "loc1", "quantity": 1}] * 3
+    resp = client.post("/inventory/batch_adjust", json=batch, headers=api_headers())
+    assert resp.status_code == 413
+    # Rejected by admission_control from Content-Length, not by the endpoint's count check.
+    assert "bytes" in resp.json()["detail"]
+
+def test_batch_adjust_requires_content_length():
+    chunks = iter([b'[{"sku": "B", "location": "loc1", "quantity": 1}]'])
+    resp = client.post(
+        "/inventory/batch_adjust",
+        content=chunks,
+        headers={**api_headers(), "Content-Type": "application/json"},
+    )
+    assert resp.status_code == 411
+
+def test_admin_limits_reports_state():
+    client.get("/inventory", headers=api_headers())
+    resp = client.get("/admin/limits", headers=api_headers())
+    assert resp.status_code == 200
+    state = resp.json()
+    assert set(state["limiters"]) == {"reads", "writes"}
+    assert state["limiters"]["reads"]["in_flight"] == 0
+    assert state["limiters"]["reads"]["admitted"] >= 1
+
+def test_concurrency_limiter_sheds_after_queue_wait():
+    async def scenario():
+        limiter = admission.ConcurrencyLimiter(limit=1, max_queue=1, max_wait=0.01)
+        assert await limiter.acquire()
+        # Queue is full -> shed immediately; queued request times out -> shed.
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert not await limiter.acquire()
+        assert not await queued
+        limiter.release()
+        assert limiter.in_flight == 0
+        return limiter.state()
+    state = asyncio.run(scenario())
+    assert state.shed == 2 and state.admitted == 1 and state.queued == 0
+
+def test_concurrency_limiter_hands_slot_to_waiter():
+    async def scenario():
+        limiter = admission.ConcurrencyLimiter(limit=1, max_queue=4, max_wait=1.0)
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.release()
+        assert await waiter
+        assert limiter.in_flight == 1
+    asyncio.run(scenario())
+
+# --- Test unknown-SKU filter ---
+
+@pytest.fixture
+def sku_filter():
+    rebuild_sku_filter()
+    return skufilter.SKU_FILTER
+
+def test_unknown_sku_is_rejected_by_filter(seed_inventory, sku_filter):
+    before = skufilter.SKU_FILTER.negative_lookups
+    assert client.get("/inventory/NOT_A_SKU", headers=api_headers()).status_code == 404
+    assert client.delete("/inventory/NOT_A_SKU", headers=api_headers()).status_code == 404
+    assert skufilter.SKU_FILTER.negative_lookups == before + 2
+
+def test_filter_tracks_adjust_and_batch_inserts(sku_filter):
+    client.post("/inventory/NEW_1/adjust", json={"sku": "NEW_1", "location": "loc1", "quantity": 1}, headers=api_headers())
+    client.post("/inventory/batch_adjust", json=[{"sku": "NEW_2", "location": "loc1", "quantity": 1}], headers=api_headers())
+    assert not sku_filter.might_contain("NEW_3")
+    assert sku_filter.might_contain("NEW_1")
+    assert sku_filter.might_contain("NEW_2")
+    assert client.get("/inventory/NEW_2", headers=api_headers()).json() == {"loc1": 1}
+
+def test_filter_rebuild_after_deletes(seed_inventory, sku_filter, monkeypatch):
+    monkeypatch.setattr(skufilter, "REBUILD_AFTER_DELETES", 1)
+    client.delete("/inventory/SKU_B", headers=api_headers())
+    assert sku_filter.needs_rebuild()
+    rebuild_sku_filter()
+    assert not sku_filter.needs_rebuild()
+    assert sku_filter.might_contain("SKU_A")
+
+def test_filter_rebuild_after_max_age(sku_filter, monkeypatch):
+    # Stock written by another worker process never reaches this process's filter.
+    conn = sqlite3.connect(DATABASE)
+    conn.execute("INSERT INTO skus (sku) VALUES ('OTHER_WORKER')")
+    conn.execute("INSERT INTO locations (location) VALUES ('loc1')")
+    conn.execute("INSERT INTO inventory SELECT s.id, l.id, 4 FROM skus s, locations l")
+    conn.commit()
+    conn.close()
+    assert client.get("/inventory/OTHER_WORKER", headers=api_headers()).status_code == 404
+    assert not sku_filter.needs_rebuild()
+    monkeypatch.setattr(skufilter, "MAX_AGE_SECONDS", 0)
+    assert sku_filter.needs_rebuild()
+    rebuild_sku_filter()
+    assert client.get("/inventory/OTHER_WORKER", headers=api_headers()).json() == {"loc1": 4}
+
+def test_sku_filter_stats(seed_inventory, sku_filter):
+    stats = client.get("/admin/sku_filter", headers=api_headers()).json()
+    assert stats["items"] == 3
+    assert stats["memory_bytes"] > 0
+    assert stats["estimated_fp_rate"] <= stats["target_fp_rate"]
+
+def test_filter_counts_sku_stocked_at_many_locations_once(sku_filter):
+    for n in range(50):
+        client.post("/inventory/SKU_M/adjust", json={"sku": "SKU_M", "location": f"loc{n}", "quantity": 1}, headers=api_headers())
+    batch = [{"sku": "SKU_M", "location": f"bin{n}", "quantity": 1} for n in range(10)]
+    client.post("/inventory/batch_adjust", json=batch, headers=api_headers())
+    stats = client.get("/admin/sku_filter", headers=api_headers()).json()
+    assert stats["items"] == 1
+    assert not skufilter.SKU_FILTER.needs_rebuild()
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = skufilter.BloomFilter(capacity=1000, fp_rate=0.01)
+    keys = [f"SKU{i}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"OTHER{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+# --- Test schema migration ---
+
+LEGACY_ROWS = [("SKU_A", "loc1", 10), ("SKU_A", "loc2", 3), ("SKU_B", "loc1", 7)]
+
+def create_legacy_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE inventory (sku TEXT, location TEXT, quantity INTEGER, PRIMARY KEY(sku, location))"
+    )
+    conn.executemany("INSERT INTO inventory VALUES (?, ?, ?)", LEGACY_ROWS)
+    conn.commit()
+    return conn
+
+def interned_rows(conn):
+    return conn.execute(
+        "SELECT s.sku, l.location, i.quantity FROM inventory i "
+        "JOIN skus s ON s.id = i.sku_id JOIN locations l ON l.id = i.location_id "
+        "ORDER BY s.sku, l.location"
+    ).fetchall()
+
+def test_migrate_legacy_inventory(tmp_path):
+    conn = create_legacy_db(tmp_path / "legacy.db")
+    create_schema(conn)
+    assert interned_rows(conn) == LEGACY_ROWS
+    conn.close()
+
+def test_failed_legacy_migration_is_rolled_back(tmp_path, monkeypatch):
+    conn = create_legacy_db(tmp_path / "legacy.db")
+    def fail_after_rename(conn):
+        raise sqlite3.OperationalError("disk I/O error")
+    monkeypatch.setattr(schema, "copy_legacy_inventory", fail_after_rename)
+    with pytest.raises(sqlite3.OperationalError):
+        create_schema(conn)
+    assert schema_version(conn) == 0
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name='inventory_legacy'").fetchone() is None
+    assert conn.execute("SELECT sku, location, quantity FROM inventory ORDER BY sku, location").fetchall() == LEGACY_ROWS
+    monkeypatch.undo()
+    create_schema(conn)
+    assert interned_rows(conn) == LEGACY_ROWS
+    conn.close()
+
+def test_create_schema_is_skipped_at_current_version(tmp_path):
+    conn = sqlite3.connect(tmp_path / "inventory.db")
+    create_schema(conn)
+    assert schema_version(conn) == SCHEMA_VERSION
+    conn.execute("DROP TABLE webhooks")
+    create_schema(conn)
+    # Up-to-date databases are trusted; no DDL runs again.
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name='webhooks'").fetchone() is None
+    conn.close()
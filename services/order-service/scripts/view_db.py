@@ -1,3 +1,4 @@
+import argparse
 import sqlite3
 import os
 
@@ -5,24 +6,39 @@ import os
 db_path = os.path.join(os.path.dirname(__file__), '..', 'src', 'orders.db')
 db_path = os.path.abspath(db_path)
 
-# Connect to the database
-conn = sqlite3.connect(db_path)
+parser = argparse.ArgumentParser(description="Summarize orders.db without dumping whole tables.")
+parser.add_argument("--db", default=db_path, help="Path to orders.db")
+parser.add_argument("--limit", type=int, default=20, help="Number of recent orders to show")
+args = parser.parse_args()
+
+# Connect read-only so this never interferes with the running service
+conn = sqlite3.connect(f"file:{os.path.abspath(args.db)}?mode=ro", uri=True)
 cursor = conn.cursor()
 
-# Print all table names
+# Print all table names with their row counts
 print("Tables:")
-for row in cursor.execute("SELECT name FROM sqlite_master WHERE type='table';"):
-    print(row)
+tables = [row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")]
+for name in tables:
+    count = conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+    print(f"{name}: {count} rows")
 
-# Print all orders
-print("\nOrder Table:")
-for row in cursor.execute("SELECT * FROM orders;"):
+# Order counts per status (served by idx_orders_status_created)
+print("\nOrders by status:")
+for row in cursor.execute("SELECT status, COUNT(*) FROM orders GROUP BY status;"):
     print(row)
 
-# Print all order items
-print("\nOrder Items Table:")
-for row in cursor.execute("SELECT * FROM order_items;"):
+# Most recent orders with their line counts
+print(f"\nLatest {args.limit} orders (id, status, created_at, lines, units):")
+for row in cursor.execute(
+    "SELECT o.id, o.status, o.created_at, COUNT(oi.sku), COALESCE(SUM(oi.quantity), 0) "
+    "FROM (SELECT id, status, created_at FROM orders ORDER BY created_at DESC, id DESC LIMIT ?) o "
+    "LEFT JOIN order_items oi ON oi.order_id = o.id "
+    "GROUP BY o.id ORDER BY o.created_at DESC, o.id DESC;",
+    (args.limit,),
+):
     print(row)
 
+print("\nFor full reports use: python -m scripts.analytics (in services/inventory-service)")
+
 # Close the connection
-conn.close()
\ No newline at end of file
+conn.close()
@@ -1,7 +1,13 @@
+import asyncio
+import hashlib
 import os
-from fastapi import FastAPI, HTTPException, status
+import secrets
+import sqlite3
+import time
+from collections import defaultdict
+from fastapi import FastAPI, Header, HTTPException, Query, status
 from pydantic import BaseModel
-from typing import List
+from typing import Dict, List, Literal, Optional, Tuple
 import aiosqlite
 import httpx
 
@@ -10,6 +16,30 @@ DATABASE = "orders.db"
 INVENTORY_URL = os.environ.get("INVENTORY_SERVICE_URL", "http://localhost:8000")
 INVENTORY_API_KEY = os.environ.get("INVENTORY_API_KEY", "testkey")
 
+# Idempotency keys must outlive the inventory service's own keys (24h default)
+# so a retried order never re-reserves stock under a fresh inventory key.
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_MAX_KEY_LENGTH = 255  # Same limit as the inventory service
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 24 * 60 * 60))
+IDEMPOTENCY_SWEEP_INTERVAL_SECONDS = int(os.environ.get("IDEMPOTENCY_SWEEP_INTERVAL_SECONDS", 60))
+IDEMPOTENCY_SWEEP_BATCH_SIZE = 500
+
+# Must not exceed the inventory service's ADMISSION_MAX_BATCH_SIZE.
+INVENTORY_MAX_BATCH_SIZE = int(os.environ.get("INVENTORY_MAX_BATCH_SIZE", 10_000))
+RESERVE_LOCATION = "warehouse_a"
+SQL_CHUNK_SIZE = 500  # Stay well below SQLite's bound-parameter limit
+
+ALLOWED_TRANSITIONS = {
+    "pending": {"confirmed", "cancelled"},
+    "confirmed": {"shipped", "cancelled"},
+    # Claimed by cancel_orders; its stock is being returned to inventory.
+    "cancelling": {"cancelled"},
+    "shipped": set(),
+    "cancelled": set(),
+}
+# Orders in these states hold reserved stock that is returned on cancellation.
+RESERVED_STATUSES = {"confirmed"}
+
 app = FastAPI(
     title="Order Service API",
     description="API for placing and managing customer orders.",
@@ -20,90 +50,434 @@ class OrderItem(BaseModel):
     sku: str
     quantity: int
 
+OrderStatus = Literal["pending", "confirmed", "cancelling", "shipped", "cancelled"]
+
 class OrderCreate(BaseModel):
     items: List[OrderItem]
+    # Pending orders reserve no stock until they are confirmed.
+    status: Literal["pending", "confirmed"] = "confirmed"
 
 class Order(BaseModel):
     id: int
     items: List[OrderItem]
     status: str
+    created_at: Optional[float] = None
+
+class StatusUpdate(BaseModel):
+    status: OrderStatus
+
+class BulkCancel(BaseModel):
+    order_ids: List[int]
+
+class BulkCancelResult(BaseModel):
+    cancelled: List[int]
+    not_cancellable: List[int]
+    not_found: List[int]
+    restocked_skus: int
+    inventory_calls: int
+
+def chunked(values: List, size: int = SQL_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def placeholders(values: List) -> str:
+    return ",".join("?" * len(values))
+
+# Stored in PRAGMA user_version; bump it whenever init_db's DDL changes.
+SCHEMA_VERSION = 2
 
 async def init_db():
     async with aiosqlite.connect(DATABASE) as conn:
+        async with conn.execute("PRAGMA user_version") as cursor:
+            (version,) = await cursor.fetchone()
+        if version >= SCHEMA_VERSION:
+            return  # Up to date: skip all DDL on startup
+        await conn.execute(
+            "CREATE TABLE IF NOT EXISTS orders (id INTEGER PRIMARY KEY AUTOINCREMENT, status TEXT, created_at REAL)"
+        )
+        async with conn.execute("PRAGMA table_info(orders)") as cursor:
+            columns = {row[1] for row in await cursor.fetchall()}
+        if "created_at" not in columns:
+            # Orders created before the lifecycle columns keep a NULL created_at.
+            await conn.execute("ALTER TABLE orders ADD COLUMN created_at REAL")
+        if "cancel_key" not in columns:
+            await conn.execute("ALTER TABLE orders ADD COLUMN cancel_key TEXT")
+        if "confirm_attempts" not in columns:
+            await conn.execute("ALTER TABLE orders ADD COLUMN confirm_attempts INTEGER NOT NULL DEFAULT 0")
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_orders_cancel_key ON orders(cancel_key)"
+        )
         await conn.execute(
-            "CREATE TABLE IF NOT EXISTS orders (id INTEGER PRIMARY KEY AUTOINCREMENT, status TEXT)"
+            "CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(status, created_at)"
+        )
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at)"
         )
         await conn.execute(
             "CREATE TABLE IF NOT EXISTS order_items (order_id INTEGER, sku TEXT, quantity INTEGER)"
         )
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)"
+        )
+        await conn.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+            "key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, order_id INTEGER NOT NULL, created_at REAL NOT NULL)"
+        )
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys(created_at)"
+        )
         await conn.commit()
+        await conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+async def sweep_idempotency_keys():
+    """Delete expired idempotency keys in small batches, one transaction each."""
+    cutoff = time.time() - IDEMPOTENCY_TTL_SECONDS
+    async with aiosqlite.connect(DATABASE) as conn:
+        while True:
+            cursor = await conn.execute(
+                "DELETE FROM idempotency_keys WHERE rowid IN "
+                "(SELECT rowid FROM idempotency_keys WHERE created_at<? LIMIT ?)",
+                (cutoff, IDEMPOTENCY_SWEEP_BATCH_SIZE),
+            )
+            await conn.commit()
+            if cursor.rowcount < IDEMPOTENCY_SWEEP_BATCH_SIZE:
+                break
+
+async def idempotency_sweeper():
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_SWEEP_INTERVAL_SECONDS)
+        try:
+            await sweep_idempotency_keys()
+        except sqlite3.Error:
+            pass  # Retry on the next interval
+
+_background_tasks = set()
 
 @app.on_event("startup")
 async def startup():
     await init_db()
+    task = asyncio.create_task(idempotency_sweeper())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
 
-async def reserve_inventory(items: List[OrderItem]) -> None:
+async def batch_adjust(client: httpx.AsyncClient, payload: List[dict], idempotency_key: Optional[str] = None,
+                       timeout: float = 5.0) -> List[dict]:
     url = f"{INVENTORY_URL}/inventory/batch_adjust"
     headers = {"X-API-Key": INVENTORY_API_KEY}
+    if idempotency_key:
+        # A retry replays the original adjustment instead of applying it again.
+        headers[IDEMPOTENCY_HEADER] = idempotency_key
+    resp = await client.post(url, json=payload, headers=headers, timeout=timeout)
+    if resp.status_code != 200:
+        raise HTTPException(status_code=502, detail="Inventory service did not respond as expected.")
+    return resp.json()
+
+async def reserve_inventory(items: List[OrderItem], idempotency_key: Optional[str] = None) -> None:
+    """Reserve all lines or none: if any line fails, the lines that succeeded are handed back.
+
+    The inventory service stores a response with failed lines like any other,
+    so a retry under the same ``idempotency_key`` replays the failure; callers
+    that want to try again must use a new key.
+    """
     # Always try to decrement from 'warehouse_a' (can be improved for multiple locations)
     payload = [
-        {"sku": item.sku, "location": "warehouse_a", "quantity": -item.quantity}
+        {"sku": item.sku, "location": RESERVE_LOCATION, "quantity": -item.quantity}
         for item in items
     ]
     async with httpx.AsyncClient() as client:
-        resp = await client.post(url, json=payload, headers=headers, timeout=5.0)
-        if resp.status_code != 200:
-            raise HTTPException(status_code=502, detail="Inventory service did not respond as expected.")
-        results = resp.json()
-        # Find any failures
-        failed = [r for r in results if not r.get("success")]
-        if failed:
-            reasons = ", ".join(
-                f"{r['sku']}@{r['location']}: {r.get('error', 'error')}" for r in failed
-            )
+        results = await batch_adjust(client, payload, idempotency_key)
+    # Find any failures
+    failed = [r for r in results if not r.get("success")]
+    if failed:
+        reserved = defaultdict(int)
+        for line, result in zip(payload, results):
+            if result.get("success"):
+                reserved[line["sku"]] -= line["quantity"]
+        if reserved:
+            release_key = idempotency_key or secrets.token_hex(16)
+            await restock_inventory(reserved, f"release:{release_key}")
+        reasons = ", ".join(
+            f"{r['sku']}@{r['location']}: {r.get('error', 'error')}" for r in failed
+        )
+        raise HTTPException(
+            status_code=400,
+            detail=f"Insufficient inventory: {reasons}"
+        )
+
+async def restock_inventory(totals: Dict[str, int], idempotency_prefix: str) -> int:
+    """Return aggregated quantities to stock. Returns the number of inventory calls made.
+
+    Lines are sent in as few ``batch_adjust`` calls as the inventory batch limit
+    allows. Each call carries ``<idempotency_prefix>:<n>``, so retrying a
+    partially failed restock never returns the same stock twice.
+    """
+    payload = [
+        {"sku": sku, "location": RESERVE_LOCATION, "quantity": quantity}
+        for sku, quantity in sorted(totals.items()) if quantity > 0
+    ]
+    calls = 0
+    async with httpx.AsyncClient() as client:
+        for n, chunk in enumerate(chunked(payload, INVENTORY_MAX_BATCH_SIZE)):
+            results = await batch_adjust(client, chunk, f"{idempotency_prefix}:{n}", timeout=30.0)
+            calls += 1
+            failed = [r for r in results if not r.get("success")]
+            if failed:
+                reasons = ", ".join(f"{r['sku']}: {r.get('error', 'error')}" for r in failed)
+                raise HTTPException(status_code=502, detail=f"Restock failed: {reasons}")
+    return calls
+
+async def find_idempotent_order(conn, key: str, fingerprint: str) -> Optional[int]:
+    async with conn.execute(
+        "SELECT fingerprint, order_id FROM idempotency_keys WHERE key=? AND created_at>=?",
+        (key, time.time() - IDEMPOTENCY_TTL_SECONDS),
+    ) as cursor:
+        row = await cursor.fetchone()
+    if row is None:
+        return None
+    if row[0] != fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail=f"{IDEMPOTENCY_HEADER} was already used for a different request",
+        )
+    return row[1]
+
+def inventory_order_key(idempotency_key: str) -> str:
+    """Fixed-length key forwarded to inventory, whatever the length of the client's key."""
+    return "order:" + hashlib.sha256(idempotency_key.encode("utf-8")).hexdigest()
+
+@app.post("/orders", response_model=Order, status_code=status.HTTP_201_CREATED)
+async def create_order(
+    order: OrderCreate,
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
+):
+    """Reserve stock and create the order.
+
+    With an ``Idempotency-Key`` a retry returns the stored order. A ``400``
+    for insufficient stock is final for that key as well (inventory replays
+    the failure), so resubmit a failed order under a new key.
+    """
+    fingerprint = None
+    if idempotency_key:
+        if len(idempotency_key) > IDEMPOTENCY_MAX_KEY_LENGTH:
             raise HTTPException(
                 status_code=400,
-                detail=f"Insufficient inventory: {reasons}"
+                detail=f"{IDEMPOTENCY_HEADER} must be at most {IDEMPOTENCY_MAX_KEY_LENGTH} characters",
             )
-
-@app.post("/orders", response_model=Order, status_code=status.HTTP_201_CREATED)
-async def create_order(order: OrderCreate):
-    # 1. Reserve inventory first!
-    await reserve_inventory(order.items)
+        # exclude_defaults keeps fingerprints stored before ``status`` existed valid.
+        fingerprint = hashlib.sha256(order.model_dump_json(exclude_defaults=True).encode("utf-8")).hexdigest()
+        async with aiosqlite.connect(DATABASE) as conn:
+            order_id = await find_idempotent_order(conn, idempotency_key, fingerprint)
+        if order_id is not None:
+            return await get_order(order_id)
+    # 1. Reserve inventory first! Pending orders reserve when they are confirmed.
+    if order.status == "confirmed":
+        await reserve_inventory(order.items, inventory_order_key(idempotency_key) if idempotency_key else None)
     # 2. If successful, create order in DB
     async with aiosqlite.connect(DATABASE) as conn:
-        cursor = await conn.execute("INSERT INTO orders (status) VALUES (?)", ("confirmed",))
+        created_at = time.time()
+        cursor = await conn.execute(
+            "INSERT INTO orders (status, created_at) VALUES (?, ?)", (order.status, created_at)
+        )
         order_id = cursor.lastrowid
         for item in order.items:
             await conn.execute(
                 "INSERT INTO order_items (order_id, sku, quantity) VALUES (?, ?, ?)",
                 (order_id, item.sku, item.quantity)
             )
+        if idempotency_key:
+            await conn.execute(
+                "INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, order_id, created_at) "
+                "SELECT ?, ?, ?, ? WHERE NOT EXISTS "
+                "(SELECT 1 FROM idempotency_keys WHERE key=? AND created_at>=?)",
+                (idempotency_key, fingerprint, order_id, time.time(),
+                 idempotency_key, time.time() - IDEMPOTENCY_TTL_SECONDS),
+            )
+            existing = await find_idempotent_order(conn, idempotency_key, fingerprint)
+            if existing != order_id:
+                # A concurrent retry with the same key finished first; keep its order.
+                await conn.rollback()
+                return await get_order(existing)
         await conn.commit()
-    return Order(id=order_id, items=order.items, status="confirmed")
+    return Order(id=order_id, items=order.items, status=order.status, created_at=created_at)
 
 @app.get("/orders", response_model=List[Order])
-async def list_orders():
-    orders = []
+async def list_orders(
+    status: Optional[OrderStatus] = Query(None, description="Filter by order status"),
+    limit: int = Query(100, ge=1, le=1000, description="Max number of orders to return"),
+    offset: int = Query(0, ge=0, description="Number of orders to skip"),
+):
+    # Newest first; served by idx_orders_status_created / idx_orders_created.
+    where_clause = " WHERE status=?" if status else ""
+    params = [status] if status else []
     async with aiosqlite.connect(DATABASE) as conn:
-        async with conn.execute("SELECT id, status FROM orders") as cursor:
+        async with conn.execute(
+            f"SELECT id, status, created_at FROM orders{where_clause} "
+            "ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+            (*params, limit, offset),
+        ) as cursor:
             order_rows = await cursor.fetchall()
-            for order_id, status in order_rows:
-                async with conn.execute("SELECT sku, quantity FROM order_items WHERE order_id=?", (order_id,)) as items_cursor:
-                    items_rows = await items_cursor.fetchall()
-                    items = [OrderItem(sku=sku, quantity=quantity) for sku, quantity in items_rows]
-                orders.append(Order(id=order_id, items=items, status=status))
-    return orders
+        items_by_order = defaultdict(list)
+        order_ids = [row[0] for row in order_rows]
+        if order_ids:
+            async with conn.execute(
+                f"SELECT order_id, sku, quantity FROM order_items WHERE order_id IN ({placeholders(order_ids)})",
+                order_ids,
+            ) as items_cursor:
+                for order_id, sku, quantity in await items_cursor.fetchall():
+                    items_by_order[order_id].append(OrderItem(sku=sku, quantity=quantity))
+    return [
+        Order(id=order_id, items=items_by_order[order_id], status=order_status, created_at=created_at)
+        for order_id, order_status, created_at in order_rows
+    ]
 
 @app.get("/orders/{order_id}", response_model=Order)
 async def get_order(order_id: int):
     async with aiosqlite.connect(DATABASE) as conn:
-        async with conn.execute("SELECT status FROM orders WHERE id=?", (order_id,)) as cursor:
+        async with conn.execute("SELECT status, created_at FROM orders WHERE id=?", (order_id,)) as cursor:
             row = await cursor.fetchone()
             if not row:
                 raise HTTPException(status_code=404, detail="Order not found")
-            status = row[0]
+            status, created_at = row
         async with conn.execute("SELECT sku, quantity FROM order_items WHERE order_id=?", (order_id,)) as items_cursor:
             items_rows = await items_cursor.fetchall()
             items = [OrderItem(sku=sku, quantity=quantity) for sku, quantity in items_rows]
-    return Order(id=order_id, items=items, status=status)
\ No newline at end of file
+    return Order(id=order_id, items=items, status=status, created_at=created_at)
+
+async def restock_cancelled(cancel_key: str) -> Tuple[int, int]:
+    """Restock every order claimed under ``cancel_key`` and mark them cancelled.
+
+    Returns ``(restocked_skus, inventory_calls)``. The totals are always
+    computed over the whole claim, so a retry sends the same chunks under the
+    same idempotency keys and the inventory service replays the ones it has
+    already applied.
+    """
+    totals = defaultdict(int)
+    async with aiosqlite.connect(DATABASE) as conn:
+        async with conn.execute(
+            "SELECT oi.sku, SUM(oi.quantity) FROM order_items oi "
+            "JOIN orders o ON o.id = oi.order_id WHERE o.cancel_key=? GROUP BY oi.sku",
+            (cancel_key,),
+        ) as cursor:
+            for sku, quantity in await cursor.fetchall():
+                totals[sku] += quantity
+    # No database lock is held while inventory is called.
+    calls = await restock_inventory(totals, f"cancel:{cancel_key}") if totals else 0
+    async with aiosqlite.connect(DATABASE) as conn:
+        await conn.execute(
+            "UPDATE orders SET status='cancelled' WHERE cancel_key=? AND status='cancelling'", (cancel_key,)
+        )
+        await conn.commit()
+    return len(totals), calls
+
+async def cancel_orders(order_ids: List[int]) -> BulkCancelResult:
+    """Cancel orders and restock their lines with aggregated ``batch_adjust`` calls.
+
+    A short write transaction cancels pending orders outright and claims
+    confirmed ones by moving them to ``cancelling`` under one ``cancel_key``.
+    Their stock is then returned outside any transaction and the claim is
+    marked ``cancelled``. If restocking fails the orders stay ``cancelling``;
+    cancelling any of them again resumes the same claim.
+    """
+    ids = sorted(set(order_ids))
+    statuses = {}
+    async with aiosqlite.connect(DATABASE) as conn:
+        await conn.execute("BEGIN IMMEDIATE")
+        for chunk in chunked(ids):
+            async with conn.execute(
+                f"SELECT id, status, cancel_key FROM orders WHERE id IN ({placeholders(chunk)})", chunk
+            ) as cursor:
+                rows = await cursor.fetchall()
+            statuses.update((order_id, (order_status, key)) for order_id, order_status, key in rows)
+        cancellable = [i for i in ids if i in statuses and "cancelled" in ALLOWED_TRANSITIONS.get(statuses[i][0], ())]
+        to_claim = [i for i in cancellable if statuses[i][0] in RESERVED_STATUSES]
+        # Claims left behind by an earlier failed or in-flight cancellation.
+        cancel_keys = sorted({statuses[i][1] for i in cancellable if statuses[i][0] == "cancelling"})
+        if to_claim:
+            cancel_key = hashlib.sha256(",".join(map(str, to_claim)).encode("utf-8")).hexdigest()
+            cancel_keys.append(cancel_key)
+            for chunk in chunked(to_claim):
+                await conn.execute(
+                    f"UPDATE orders SET status='cancelling', cancel_key=? WHERE id IN ({placeholders(chunk)})",
+                    (cancel_key, *chunk),
+                )
+        for chunk in chunked([i for i in cancellable if statuses[i][0] == "pending"]):
+            await conn.execute(
+                f"UPDATE orders SET status='cancelled' WHERE id IN ({placeholders(chunk)})", chunk
+            )
+        await conn.commit()
+
+    restocked_skus = calls = 0
+    for cancel_key in cancel_keys:
+        skus, key_calls = await restock_cancelled(cancel_key)
+        restocked_skus += skus
+        calls += key_calls
+    cancelled = set(cancellable)
+    return BulkCancelResult(
+        cancelled=cancellable,
+        not_cancellable=[i for i in ids if i in statuses and i not in cancelled],
+        not_found=[i for i in ids if i not in statuses],
+        restocked_skus=restocked_skus,
+        inventory_calls=calls,
+    )
+
+@app.post("/orders/cancel", response_model=BulkCancelResult)
+async def bulk_cancel_orders(request: BulkCancel):
+    """Cancel many orders at once (e.g. a recall), restocking all their lines."""
+    return await cancel_orders(request.order_ids)
+
+@app.post("/orders/{order_id}/status", response_model=Order)
+async def update_order_status(order_id: int, update: StatusUpdate):
+    if update.status == "cancelled":
+        result = await cancel_orders([order_id])
+        if result.not_found:
+            raise HTTPException(status_code=404, detail="Order not found")
+        if result.not_cancellable:
+            raise HTTPException(status_code=409, detail="Order can no longer be cancelled")
+        return await get_order(order_id)
+    async with aiosqlite.connect(DATABASE) as conn:
+        async with conn.execute("SELECT status, confirm_attempts FROM orders WHERE id=?", (order_id,)) as cursor:
+            row = await cursor.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Order not found")
+        current, attempts = row
+        if update.status not in ALLOWED_TRANSITIONS.get(current, ()):
+            raise HTTPException(status_code=409, detail=f"Cannot change order from {current} to {update.status}")
+        items = []
+        if current == "pending" and update.status == "confirmed":
+            async with conn.execute("SELECT sku, quantity FROM order_items WHERE order_id=?", (order_id,)) as cursor:
+                items = [OrderItem(sku=sku, quantity=quantity) for sku, quantity in await cursor.fetchall()]
+    if items:
+        # Pending orders hold no stock yet; confirming reserves it, outside any transaction.
+        try:
+            await reserve_inventory(items, f"confirm:{order_id}:{attempts}")
+        except HTTPException as e:
+            if e.status_code == 400:
+                # Inventory replays this failure for the key, so the next attempt needs a fresh one.
+                async with aiosqlite.connect(DATABASE) as conn:
+                    await conn.execute(
+                        "UPDATE orders SET confirm_attempts = confirm_attempts + 1 WHERE id=? AND confirm_attempts=?",
+                        (order_id, attempts),
+                    )
+                    await conn.commit()
+            raise
+    async with aiosqlite.connect(DATABASE) as conn:
+        # Only apply the change if nobody moved the order on in the meantime.
+        cursor = await conn.execute(
+            "UPDATE orders SET status=? WHERE id=? AND status=?", (update.status, order_id, current)
+        )
+        await conn.commit()
+        changed = cursor.rowcount
+        cancelled_while_pending = False
+        if not changed and items:
+            async with conn.execute("SELECT status, cancel_key FROM orders WHERE id=?", (order_id,)) as cursor:
+                row = await cursor.fetchone()
+            # Cancelled straight from pending, so nothing returns the stock we just reserved.
+            cancelled_while_pending = row == ("cancelled", None)
+    if not changed:
+        if cancelled_while_pending:
+            totals = defaultdict(int)
+            for item in items:
+                totals[item.sku] += item.quantity
+            await restock_inventory(totals, f"unconfirm:{order_id}")
+        raise HTTPException(status_code=409, detail="Order changed concurrently, retry")
+    return await get_order(order_id)
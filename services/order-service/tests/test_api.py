@@ -0,0 +1,272 @@
+import asyncio
+import hashlib
+import sqlite3
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from src import main
+from src.main import app
+
+client = TestClient(app)
+
+class FakeInventory:
+    """Stands in for the inventory service's batch_adjust, including idempotent replay."""
+
+    def __init__(self):
+        self.stock = {}
+        self.calls = []
+        self.responses = {}
+        self.fail_calls = set()
+        self.on_call = None
+
+    async def batch_adjust(self, client, payload, idempotency_key=None, timeout=5.0):
+        self.calls.append((payload, idempotency_key))
+        if self.on_call:
+            self.on_call(payload, idempotency_key)
+        if len(self.calls) in self.fail_calls:
+            raise HTTPException(status_code=502, detail="Inventory service did not respond as expected.")
+        if idempotency_key in self.responses:
+            return self.responses[idempotency_key]
+        results = []
+        for line in payload:
+            new_quantity = self.stock.get(line["sku"], 0) + line["quantity"]
+            if new_quantity < 0:
+                results.append({**line, "success": False, "error": "Insufficient stock"})
+                continue
+            self.stock[line["sku"]] = new_quantity
+            results.append({**line, "quantity": new_quantity, "success": True})
+        if idempotency_key:
+            self.responses[idempotency_key] = results
+        return results
+
+@pytest.fixture(autouse=True)
+def fresh_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "DATABASE", str(tmp_path / "orders.db"))
+    asyncio.run(main.init_db())
+
+@pytest.fixture
+def inventory(monkeypatch):
+    fake = FakeInventory()
+    fake.stock = {"SKU_A": 100, "SKU_B": 100, "SKU_C": 100}
+    monkeypatch.setattr(main, "batch_adjust", fake.batch_adjust)
+    return fake
+
+def create_order(items, status=None, headers=None):
+    body = {"items": [{"sku": sku, "quantity": quantity} for sku, quantity in items]}
+    if status:
+        body["status"] = status
+    return client.post("/orders", json=body, headers=headers or {})
+
+def set_status(order_id, new_status):
+    return client.post(f"/orders/{order_id}/status", json={"status": new_status})
+
+def order_status(order_id):
+    return client.get(f"/orders/{order_id}").json()["status"]
+
+# --- Test order lifecycle ---
+
+def test_create_order_reserves_stock(inventory):
+    resp = create_order([("SKU_A", 3), ("SKU_B", 1)])
+    assert resp.status_code == 201
+    assert resp.json()["status"] == "confirmed"
+    assert inventory.stock["SKU_A"] == 97
+    assert inventory.stock["SKU_B"] == 99
+
+def test_pending_order_reserves_stock_when_confirmed(inventory):
+    resp = create_order([("SKU_A", 3)], status="pending")
+    assert resp.status_code == 201
+    order_id = resp.json()["id"]
+    assert resp.json()["status"] == "pending"
+    assert inventory.calls == []
+    resp = set_status(order_id, "confirmed")
+    assert resp.status_code == 200
+    assert resp.json()["status"] == "confirmed"
+    assert inventory.calls == [([{"sku": "SKU_A", "location": "warehouse_a", "quantity": -3}], f"confirm:{order_id}:0")]
+    assert inventory.stock["SKU_A"] == 97
+
+def test_confirm_pending_order_with_insufficient_stock(inventory):
+    order_id = create_order([("SKU_A", 500)], status="pending").json()["id"]
+    resp = set_status(order_id, "confirmed")
+    assert resp.status_code == 400
+    assert order_status(order_id) == "pending"
+
+def test_confirm_after_restock_uses_a_fresh_key(inventory):
+    order_id = create_order([("SKU_A", 500)], status="pending").json()["id"]
+    assert set_status(order_id, "confirmed").status_code == 400
+    inventory.stock["SKU_A"] = 1000
+    resp = set_status(order_id, "confirmed")
+    assert resp.status_code == 200
+    assert inventory.stock["SKU_A"] == 500
+    assert [key for _, key in inventory.calls] == [f"confirm:{order_id}:0", f"confirm:{order_id}:1"]
+
+def test_partially_failed_confirm_hands_back_reserved_lines(inventory):
+    order_id = create_order([("SKU_A", 3), ("SKU_B", 500)], status="pending").json()["id"]
+    assert set_status(order_id, "confirmed").status_code == 400
+    assert order_status(order_id) == "pending"
+    assert inventory.stock == {"SKU_A": 100, "SKU_B": 100, "SKU_C": 100}
+    assert inventory.calls[-1][1] == f"release:confirm:{order_id}:0:0"
+
+def test_confirm_pending_order_that_was_cancelled_meanwhile(inventory):
+    order_id = create_order([("SKU_A", 3)], status="pending").json()["id"]
+    def cancel_during_reserve(payload, idempotency_key):
+        if idempotency_key == f"confirm:{order_id}:0":
+            conn = sqlite3.connect(main.DATABASE)
+            conn.execute("UPDATE orders SET status='cancelled' WHERE id=?", (order_id,))
+            conn.commit()
+            conn.close()
+    inventory.on_call = cancel_during_reserve
+    resp = set_status(order_id, "confirmed")
+    assert resp.status_code == 409
+    # The reservation made for the lost confirmation is handed back.
+    assert inventory.calls[-1][1] == f"unconfirm:{order_id}:0"
+    assert inventory.stock["SKU_A"] == 100
+
+def test_invalid_transitions_are_rejected(inventory):
+    order_id = create_order([("SKU_A", 1)]).json()["id"]
+    assert set_status(order_id, "cancelling").status_code == 409
+    assert set_status(order_id, "pending").status_code == 409
+    assert set_status(order_id, "shipped").status_code == 200
+    assert set_status(order_id, "confirmed").status_code == 409
+    assert set_status(order_id, "cancelled").status_code == 409
+    assert set_status(9999, "shipped").status_code == 404
+    assert set_status(9999, "cancelled").status_code == 404
+
+def test_cancel_confirmed_order_restocks(inventory):
+    order_id = create_order([("SKU_A", 3)]).json()["id"]
+    resp = set_status(order_id, "cancelled")
+    assert resp.status_code == 200
+    assert resp.json()["status"] == "cancelled"
+    assert inventory.stock["SKU_A"] == 100
+
+def test_cancel_pending_order_does_not_restock(inventory):
+    order_id = create_order([("SKU_A", 3)], status="pending").json()["id"]
+    assert set_status(order_id, "cancelled").status_code == 200
+    assert inventory.calls == []
+    assert inventory.stock["SKU_A"] == 100
+
+# --- Test bulk cancel ---
+
+def test_bulk_cancel_aggregates_restock_per_sku(inventory):
+    first = create_order([("SKU_A", 2), ("SKU_B", 1)]).json()["id"]
+    second = create_order([("SKU_A", 5)]).json()["id"]
+    pending = create_order([("SKU_C", 4)], status="pending").json()["id"]
+    shipped = create_order([("SKU_C", 1)]).json()["id"]
+    set_status(shipped, "shipped")
+    inventory.calls.clear()
+    resp = client.post("/orders/cancel", json={"order_ids": [second, first, pending, shipped, 9999, first]})
+    assert resp.status_code == 200
+    assert resp.json() == {
+        "cancelled": sorted([first, second, pending]),
+        "not_cancellable": [shipped],
+        "not_found": [9999],
+        "restocked_skus": 2,
+        "inventory_calls": 1,
+    }
+    payload, key = inventory.calls[0]
+    assert payload == [
+        {"sku": "SKU_A", "location": "warehouse_a", "quantity": 7},
+        {"sku": "SKU_B", "location": "warehouse_a", "quantity": 1},
+    ]
+    assert key.startswith("cancel:") and key.endswith(":0")
+    assert inventory.stock == {"SKU_A": 100, "SKU_B": 100, "SKU_C": 99}
+
+def test_bulk_cancel_chunks_by_inventory_batch_limit(inventory, monkeypatch):
+    monkeypatch.setattr(main, "INVENTORY_MAX_BATCH_SIZE", 2)
+    inventory.stock.update({"SKU_D": 100, "SKU_E": 100})
+    order_id = create_order([(sku, 1) for sku in ("SKU_A", "SKU_B", "SKU_C", "SKU_D", "SKU_E")]).json()["id"]
+    inventory.calls.clear()
+    resp = client.post("/orders/cancel", json={"order_ids": [order_id]})
+    assert resp.json()["inventory_calls"] == 3
+    assert [len(payload) for payload, _ in inventory.calls] == [2, 2, 1]
+    assert [key.rsplit(":", 1)[1] for _, key in inventory.calls] == ["0", "1", "2"]
+    assert all(quantity == 100 for quantity in inventory.stock.values())
+
+def test_failed_restock_is_resumed_without_double_restock(inventory, monkeypatch):
+    monkeypatch.setattr(main, "INVENTORY_MAX_BATCH_SIZE", 1)
+    first = create_order([("SKU_A", 2)]).json()["id"]
+    second = create_order([("SKU_B", 3)]).json()["id"]
+    inventory.calls.clear()
+    inventory.fail_calls = {2}
+    resp = client.post("/orders/cancel", json={"order_ids": [first, second]})
+    assert resp.status_code == 502
+    assert inventory.stock == {"SKU_A": 100, "SKU_B": 97, "SKU_C": 100}
+    # Claimed orders can no longer ship while their stock is being returned.
+    assert order_status(first) == "cancelling"
+    assert set_status(second, "shipped").status_code == 409
+    # Cancelling either order resumes the whole claim under the same keys.
+    resp = set_status(second, "cancelled")
+    assert resp.status_code == 200
+    assert inventory.stock == {"SKU_A": 100, "SKU_B": 100, "SKU_C": 100}
+    assert order_status(first) == "cancelled"
+    assert inventory.calls[2][1] == inventory.calls[0][1]
+
+def test_bulk_cancel_holds_no_lock_while_restocking(inventory):
+    order_id = create_order([("SKU_A", 2)]).json()["id"]
+    writes = []
+    def write_during_restock(payload, idempotency_key):
+        conn = sqlite3.connect(main.DATABASE, timeout=0)
+        conn.execute("BEGIN IMMEDIATE")  # Raises "database is locked" if cancel still holds it
+        conn.rollback()
+        conn.close()
+        writes.append(idempotency_key)
+    inventory.on_call = write_during_restock
+    resp = client.post("/orders/cancel", json={"order_ids": [order_id]})
+    assert resp.status_code == 200
+    assert len(writes) == 1
+
+# --- Test Idempotency-Key on order creation ---
+
+def test_order_idempotency_key_replays_order(inventory):
+    headers = {"Idempotency-Key": "order-1"}
+    first = create_order([("SKU_A", 3)], headers=headers)
+    retry = create_order([("SKU_A", 3)], headers=headers)
+    assert first.status_code == retry.status_code == 201
+    assert retry.json() == first.json()
+    assert inventory.stock["SKU_A"] == 97
+    assert [key for _, key in inventory.calls] == [main.inventory_order_key("order-1")]
+    assert len(client.get("/orders").json()) == 1
+
+def test_order_idempotency_key_length(inventory):
+    resp = create_order([("SKU_A", 3)], headers={"Idempotency-Key": "k" * 255})
+    assert resp.status_code == 201
+    assert len(inventory.calls[0][1]) == len("order:") + 64
+    resp = create_order([("SKU_A", 3)], headers={"Idempotency-Key": "k" * 256})
+    assert resp.status_code == 400
+
+def test_failed_order_releases_reserved_lines(inventory):
+    headers = {"Idempotency-Key": "order-2"}
+    assert create_order([("SKU_A", 3), ("SKU_B", 500)], headers=headers).status_code == 400
+    assert inventory.stock == {"SKU_A": 100, "SKU_B": 100, "SKU_C": 100}
+    # The failure is final for this key; a retry replays it and releases nothing twice.
+    assert create_order([("SKU_A", 3), ("SKU_B", 500)], headers=headers).status_code == 400
+    assert inventory.stock == {"SKU_A": 100, "SKU_B": 100, "SKU_C": 100}
+    assert client.get("/orders").json() == []
+
+def test_order_idempotency_key_reused_for_different_order(inventory):
+    headers = {"Idempotency-Key": "order-1"}
+    create_order([("SKU_A", 3)], headers=headers)
+    resp = create_order([("SKU_A", 4)], headers=headers)
+    assert resp.status_code == 422
+    assert inventory.stock["SKU_A"] == 97
+
+def test_order_idempotency_key_concurrent_retry_wins(inventory):
+    order = main.OrderCreate(items=[main.OrderItem(sku="SKU_A", quantity=3)])
+    fingerprint = hashlib.sha256(order.model_dump_json(exclude_defaults=True).encode("utf-8")).hexdigest()
+    def finish_concurrent_retry(payload, idempotency_key):
+        # The other request reserved under the same forwarded key and committed first.
+        conn = sqlite3.connect(main.DATABASE)
+        order_id = conn.execute("INSERT INTO orders (status, created_at) VALUES ('confirmed', 0)").lastrowid
+        conn.execute("INSERT INTO order_items VALUES (?, 'SKU_A', 3)", (order_id,))
+        conn.execute(
+            "INSERT INTO idempotency_keys VALUES ('order-1', ?, ?, strftime('%s', 'now'))", (fingerprint, order_id)
+        )
+        conn.commit()
+        conn.close()
+        winners.append(order_id)
+    winners = []
+    inventory.on_call = finish_concurrent_retry
+    resp = create_order([("SKU_A", 3)], headers={"Idempotency-Key": "order-1"})
+    assert resp.status_code == 201
+    assert resp.json()["id"] == winners[0]
+    # The losing insert is rolled back; only the winner's order exists.
+    assert [o["id"] for o in client.get("/orders").json()] == winners